@@ -2,51 +2,54 @@ from flask import Flask
 from flask_migrate import Migrate
 from flask_login import LoginManager
 
-from routes.default import app as bp_default
-from routes.api import app as bp_api
-from routes.auth import app as bp_auth
-from routes.vm import app as bp_ct
-
 from models.connection import db
-from models.model import User
-from models.model import *
-import os
+from config import get_config
 
-from dotenv import load_dotenv
+migrate = Migrate()
+login_manager = LoginManager()
+login_manager.login_view = 'auth.login'
 
-load_dotenv()
-app = Flask(__name__)
 
-app.register_blueprint(bp_default)
-app.register_blueprint(bp_api, url_prefix='/api')
-app.register_blueprint(bp_auth)
-app.register_blueprint(bp_ct)
+@login_manager.user_loader
+def load_user(user_id):
+    from services.identity import load_identity
 
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('SQLALCHEMY_DATABASE_URI')
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 165465)
+    return load_identity(user_id)
 
-db.init_app(app)
-migrate = Migrate(app, db)
 
-login_manager = LoginManager()
+def create_app(config=None):
+    app = Flask(__name__)
+    if isinstance(config, dict):
+        app.config.from_object(get_config())
+        app.config.update(config)
+    else:
+        app.config.from_object(config if isinstance(config, type) else get_config(config))
 
-login_manager.login_view = 'auth.login'
-login_manager.init_app(app)
+    if not app.config.get('SECRET_KEY'):
+        raise RuntimeError('SECRET_KEY non impostata')
 
+    # I blueprint importano i modelli e, tramite loro, i servizi Proxmox:
+    # caricati qui restano fuori dall'import del modulo
+    from routes.default import app as bp_default
+    from routes.api import app as bp_api
+    from routes.auth import app as bp_auth
+    from routes.vm import app as bp_ct
+    from cli import register_cli
+    from services import metrics
 
-@login_manager.user_loader
-def load_user(user_id):
-    stmt = db.select(User).filter_by(id=user_id)
-    user = db.session.execute(stmt).scalar_one_or_none()
-    return user
+    app.register_blueprint(bp_default)
+    app.register_blueprint(bp_api, url_prefix='/api')
+    app.register_blueprint(bp_auth)
+    app.register_blueprint(bp_ct)
 
+    db.init_app(app)
+    migrate.init_app(app, db)
+    login_manager.init_app(app)
+    register_cli(app)
+    metrics.init_app(app)
 
-with app.app_context():
-    db.create_all()
-    init_db()
+    return app
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
-
- 
\ No newline at end of file
+    create_app('dev').run()
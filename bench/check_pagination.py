@@ -0,0 +1,85 @@
+"""Controlla che la paginazione a cursore delle dashboard e di /api/requests visiti ogni richiesta una volta.
+
+    python -m bench.check_pagination --requests 60
+
+Le richieste vengono create con un solo commit, quindi quasi tutte nello stesso secondo di created_at:
+è il caso in cui un cursore basato su created_at ripete le pagine su SQLite.
+Esce con errore se una pagina ripete un id o se qualche richiesta non viene mai visitata.
+"""
+import argparse
+import re
+import sys
+
+from bench.run import _configure_env, _create_app, _setup_db, _add_requests
+
+ROW_RE = re.compile(r'data-req-id="(\d+)"')
+NEXT_RE = re.compile(r'[?&]cursor=([^"&]+)')
+
+
+def _walk(fetch, max_pages):
+    """Segue i cursori da fetch(cursor) -> (ids, next_cursor); restituisce gli id nell'ordine visitato."""
+    seen, cursor = [], None
+    for _ in range(max_pages):
+        ids, cursor = fetch(cursor)
+        seen.extend(ids)
+        if not cursor:
+            return seen
+    sys.exit(f'Più di {max_pages} pagine: i cursori non avanzano')
+
+
+def _html_pages(client, endpoint):
+    def fetch(cursor):
+        html = client.get(endpoint, query_string={'cursor': cursor} if cursor else None).get_data(as_text=True)
+        match = NEXT_RE.search(html)
+        return [int(i) for i in ROW_RE.findall(html)], match.group(1) if match else None
+    return fetch
+
+
+def _api_pages(client, limit):
+    def fetch(cursor):
+        params = {'limit': limit, 'fields': 'id'}
+        if cursor:
+            params['cursor'] = cursor
+        body = client.get('/api/requests', query_string=params).get_json()
+        return [r['id'] for r in body['requests']], body['next_cursor']
+    return fetch
+
+
+def _check(name, seen, expected):
+    repeated = sorted({i for i in seen if seen.count(i) > 1})
+    missing = sorted(set(expected) - set(seen))
+    print(f'{name}: {len(seen)} righe visitate, {len(repeated)} ripetute, {len(missing)} mancanti')
+    return not repeated and not missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Controllo della paginazione delle richieste')
+    parser.add_argument('--requests', type=int, default=60, help='Richieste da creare')
+    parser.add_argument('--limit', type=int, default=7, help='Righe per pagina di /api/requests')
+    parser.add_argument('--database-url', help='Database da usare al posto di un SQLite temporaneo (verrà popolato)')
+    args = parser.parse_args()
+    args.tier, args.ipam, args.node_concurrency = 'mix', False, 2
+
+    _configure_env(args, 8006)
+    app = _create_app(args)
+    user_id = _setup_db(app, args)
+    req_ids = _add_requests(app, args, user_id)
+    max_pages = args.requests + 2
+
+    user = app.test_client()
+    user.post('/login', data={'username': 'bench', 'password': 'bench-password'})
+    admin = app.test_client()
+    admin.post('/login', data={'username': 'administrator', 'password': 'Admin123!'})
+
+    ok = all([
+        _check('/dashboard', _walk(_html_pages(user, '/dashboard'), max_pages), req_ids),
+        _check('/admin/dashboard', _walk(_html_pages(admin, '/admin/dashboard'), max_pages), req_ids),
+        _check('/api/requests (utente)', _walk(_api_pages(user, args.limit), max_pages), req_ids),
+        _check('/api/requests (admin)', _walk(_api_pages(admin, args.limit), max_pages), req_ids),
+    ])
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
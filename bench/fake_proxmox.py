@@ -0,0 +1,325 @@
+"""Finto cluster Proxmox in memoria per i benchmark del provisioning.
+
+Implementa solo le API usate dal portale, con latenze, durata dei clone,
+percentuali di errore e nodi lenti configurabili. Si avvia da solo con
+`python -m bench.fake_proxmox --port 8006` oppure da bench/run.py.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from services.metrics import endpoint_template
+
+GIB = 1024 ** 3
+
+
+class FakeCluster:
+    def __init__(self, nodes=('px1', 'px2', 'px3'), templates=None, latency=0.02,
+                 clone_seconds=2.0, ip_delay=0.0, clone_failure_rate=0.0, start_failure_rate=0.0,
+                 node_slowness=None, host_slowness=None, down_hosts=(), seed=None):
+        self.nodes = list(nodes)
+        self.latency = latency
+        self.clone_seconds = clone_seconds
+        self.ip_delay = ip_delay
+        self.clone_failure_rate = clone_failure_rate
+        self.start_failure_rate = start_failure_rate
+        self.node_slowness = node_slowness or {}
+        # Per host (indirizzo su cui arriva la chiamata): API lenta o irraggiungibile
+        self.host_slowness = host_slowness or {}
+        self.down_hosts = set(down_hosts)
+        self.random = random.Random(seed)
+        self.requests = Counter()
+        self.containers = {}
+        self.tasks = {}
+        self._task_seq = 0
+        self._lock = threading.Lock()
+        for node, vmid in zip(self.nodes, templates or range(101, 101 + len(self.nodes))):
+            self.containers[vmid] = {'node': node, 'name': f'template-{node}', 'status': 'stopped',
+                                     'template': 1, 'tags': 'ct-template', 'maxmem': 2 * GIB}
+
+    def host(self, node):
+        return f'127.0.0.{self.nodes.index(node) + 1}'
+
+    def slowness(self, node):
+        return self.node_slowness.get(node, 1.0)
+
+    def _new_task(self, node, kind, vmid, duration, ok=True):
+        with self._lock:
+            self._task_seq += 1
+            upid = f'UPID:{node}:{self._task_seq:08X}:00000000:{int(time.time()):08X}:{kind}:{vmid}:root@pam:'
+            self.tasks[upid] = {'node': node, 'type': kind, 'id': str(vmid), 'starttime': time.time(),
+                                'endtime': time.time() + duration, 'exitstatus': 'OK' if ok else 'clone failed'}
+        return upid
+
+    def _task_view(self, upid):
+        task = self.tasks[upid]
+        data = {'upid': upid, 'node': task['node'], 'type': task['type'], 'id': task['id'],
+                'starttime': int(task['starttime'])}
+        if time.time() >= task['endtime']:
+            data.update(status=task['exitstatus'], endtime=int(task['endtime']))
+        return data
+
+    def _address(self, vmid):
+        return f'10.{(vmid >> 16) & 255}.{(vmid >> 8) & 255}.{vmid & 255 or 1}'
+
+    # --- API ---
+
+    def cluster_nextid(self, query):
+        with self._lock:
+            return str(max([99] + list(self.containers)) + 1)
+
+    def cluster_resources(self, query):
+        data = []
+        if query.get('type') != 'vm':
+            for node in self.nodes:
+                used = sum(ct.get('maxmem', 0) for ct in self.containers.values()
+                           if ct['node'] == node and ct['status'] == 'running')
+                data.append({'type': 'node', 'node': node, 'status': 'online', 'cpu': 0.1, 'maxcpu': 32,
+                             'mem': used, 'maxmem': 128 * GIB, 'disk': 0, 'maxdisk': 2048 * GIB})
+        with self._lock:
+            for vmid, ct in self.containers.items():
+                data.append({'type': 'lxc', 'vmid': vmid, 'node': ct['node'], 'name': ct['name'],
+                             'tags': ct.get('tags', ''),
+                             'status': ct['status'], 'template': ct.get('template', 0), 'cpu': 0,
+                             'mem': 0, 'maxmem': ct.get('maxmem', 0), 'netin': 0, 'netout': 0,
+                             'uptime': int(time.time() - ct['started_at']) if ct.get('started_at') else 0})
+        return data
+
+    def cluster_status(self):
+        data = [{'type': 'cluster', 'id': 'cluster', 'name': 'fake', 'nodes': len(self.nodes), 'quorate': 1}]
+        for i, node in enumerate(self.nodes):
+            data.append({'type': 'node', 'id': f'node/{node}', 'name': node, 'nodeid': i + 1,
+                         'ip': self.host(node), 'online': 1, 'local': 0})
+        return data
+
+    def cluster_tasks(self, query):
+        with self._lock:
+            return [self._task_view(upid) for upid in self.tasks]
+
+    def task_status(self, node, upid):
+        with self._lock:
+            if upid not in self.tasks:
+                return None
+            view = self._task_view(upid)
+        if 'endtime' in view:
+            return {'status': 'stopped', 'exitstatus': view['status']}
+        return {'status': 'running'}
+
+    def node_status(self, node):
+        return {'cpu': 0.1, 'cpuinfo': {'cpus': 32}, 'memory': {'total': 128 * GIB, 'used': 16 * GIB},
+                'rootfs': {'total': 2048 * GIB, 'used': 100 * GIB}}
+
+    def clone(self, node, template, params):
+        newid = int(params.get('newid', 0))
+        with self._lock:
+            source = self.containers.get(template)
+            if source is None or source['node'] != node:
+                return 500, f'CT {template} non presente su {node}'
+            if newid in self.containers:
+                return 500, f'CT {newid} already exists'
+            self.containers[newid] = {'node': node, 'name': params.get('hostname', f'ct{newid}'),
+                                      'status': 'stopped', 'maxmem': 2 * GIB}
+        ok = self.random.random() >= self.clone_failure_rate
+        if not ok:
+            with self._lock:
+                self.containers.pop(newid, None)
+        duration = self.clone_seconds * self.slowness(node) * (1 if params.get('full') == '1' else 0.3)
+        return 200, self._new_task(node, 'vzclone', template, duration, ok)
+
+    def config(self, node, vmid, params):
+        with self._lock:
+            ct = self.containers.get(vmid)
+            if ct is None:
+                return 500, f'CT {vmid} does not exist'
+            if 'hostname' in params:
+                ct['name'] = params['hostname']
+            if 'memory' in params:
+                ct['maxmem'] = int(params['memory']) * 1024 * 1024
+            if 'ip=' in params.get('net0', ''):
+                ct['ip'] = params['net0'].split('ip=')[1].split('/')[0]
+        return 200, None
+
+    def set_status(self, node, vmid, action):
+        with self._lock:
+            ct = self.containers.get(vmid)
+            if ct is None:
+                return 500, f'CT {vmid} does not exist'
+        if action == 'start' and self.random.random() < self.start_failure_rate:
+            return 500, 'startup for container failed'
+        with self._lock:
+            ct['status'] = {'start': 'running', 'resume': 'running', 'stop': 'stopped',
+                            'shutdown': 'stopped', 'suspend': 'stopped'}[action]
+            ct['started_at'] = time.time() if ct['status'] == 'running' else None
+        return 200, self._new_task(node, f'vz{action}', vmid, 0)
+
+    def current_status(self, node, vmid):
+        with self._lock:
+            ct = self.containers.get(vmid)
+            if ct is None or ct['node'] != node:
+                return 500, f'CT {vmid} does not exist'
+            return 200, {'vmid': vmid, 'name': ct['name'], 'status': ct['status']}
+
+    def destroy(self, node, vmid):
+        with self._lock:
+            ct = self.containers.get(vmid)
+            if ct is None or ct.get('template'):
+                return 500, f'CT {vmid} does not exist'
+            if ct['status'] == 'running':
+                return 500, f'CT {vmid} is running'
+            del self.containers[vmid]
+        return 200, self._new_task(node, 'vzdestroy', vmid, 0)
+
+    def interfaces(self, node, vmid):
+        with self._lock:
+            ct = self.containers.get(vmid)
+            if ct is None:
+                return 500, f'CT {vmid} does not exist'
+            if ct['status'] != 'running' or time.time() - ct['started_at'] < self.ip_delay * self.slowness(node):
+                return 200, [{'name': 'lo', 'inet': '127.0.0.1/8'}]
+            address = ct.get('ip') or self._address(vmid)
+        return 200, [{'name': 'lo', 'inet': '127.0.0.1/8'},
+                     {'name': 'eth0', 'inet': f'{address}/24',
+                      'ip-addresses': [{'ip-address': address, 'prefix': 24}]}]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, data):
+        body = json.dumps({'data': data} if status == 200 else {'message': data, 'data': None}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _params(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode() if length else ''
+        return {k: v[-1] for k, v in parse_qs(body).items()}
+
+    def _dispatch(self, method):
+        cluster = self.server.cluster
+        url = urlsplit(self.path)
+        path = url.path.removeprefix('/api2/json')
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        params = self._params() if method in ('POST', 'PUT') else {}
+        cluster.requests[(method, endpoint_template(path))] += 1
+
+        host = (self.headers.get('Host') or '').rsplit(':', 1)[0]
+        if host in cluster.down_hosts:
+            # Chiude la connessione senza rispondere, come un pveproxy che non c'è
+            self.close_connection = True
+            return
+
+        parts = path.strip('/').split('/')
+        node = parts[1] if len(parts) > 1 and parts[0] == 'nodes' else None
+        time.sleep(cluster.latency * cluster.slowness(node) * cluster.host_slowness.get(host, 1.0))
+
+        if method == 'GET' and path == '/version':
+            return self._reply(200, {'version': '8.2.4', 'release': '8.2', 'repoid': 'fake'})
+        if method == 'GET' and path == '/cluster/nextid':
+            return self._reply(200, cluster.cluster_nextid(query))
+        if method == 'GET' and path == '/cluster/resources':
+            return self._reply(200, cluster.cluster_resources(query))
+        if method == 'GET' and path == '/cluster/status':
+            return self._reply(200, cluster.cluster_status())
+        if method == 'GET' and path == '/cluster/tasks':
+            return self._reply(200, cluster.cluster_tasks(query))
+        if node is None or node not in cluster.nodes:
+            return self._reply(404, 'Not implemented')
+
+        rest = parts[2:]
+        if method == 'GET' and rest == ['status']:
+            return self._reply(200, cluster.node_status(node))
+        if method == 'GET' and len(rest) == 3 and rest[0] == 'tasks' and rest[2] == 'status':
+            data = cluster.task_status(node, rest[1])
+            return self._reply(200, data) if data else self._reply(500, 'no such task')
+        if len(rest) >= 2 and rest[0] == 'lxc' and rest[1].isdigit():
+            vmid = int(rest[1])
+            action = rest[2:]
+            if method == 'POST' and action == ['clone']:
+                return self._reply(*cluster.clone(node, vmid, params))
+            if method == 'PUT' and action == ['config']:
+                return self._reply(*cluster.config(node, vmid, params))
+            if method == 'POST' and len(action) == 2 and action[0] == 'status' \
+                    and action[1] in ('start', 'stop', 'shutdown', 'suspend', 'resume'):
+                return self._reply(*cluster.set_status(node, vmid, action[1]))
+            if method == 'GET' and action == ['status', 'current']:
+                return self._reply(*cluster.current_status(node, vmid))
+            if method == 'GET' and action == ['interfaces']:
+                return self._reply(*cluster.interfaces(node, vmid))
+            if method == 'DELETE' and not action:
+                return self._reply(*cluster.destroy(node, vmid))
+        return self._reply(404, 'Not implemented')
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+
+def parse_slowness(values):
+    slowness = {}
+    for value in values or ():
+        node, factor = value.split('=', 1)
+        slowness[node] = float(factor)
+    return slowness
+
+
+def start_server(cluster, host='127.0.0.1', port=0):
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.cluster = cluster
+    threading.Thread(target=server.serve_forever, name='fake-proxmox', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Finto cluster Proxmox per i benchmark')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8006)
+    parser.add_argument('--nodes', type=int, default=3, help='Nodi del cluster (px1, px2, ... su 127.0.0.1, .2, ...)')
+    parser.add_argument('--latency', type=float, default=0.02, help='Secondi di latenza per chiamata')
+    parser.add_argument('--clone-seconds', type=float, default=2.0, help='Durata di un clone full')
+    parser.add_argument('--ip-delay', type=float, default=0.0, help='Secondi prima che il CT annunci un IP')
+    parser.add_argument('--clone-failure-rate', type=float, default=0.0)
+    parser.add_argument('--start-failure-rate', type=float, default=0.0)
+    parser.add_argument('--slow-node', action='append', metavar='NODE=FATTORE',
+                        help='Moltiplica latenze e durate su un nodo, es. px2=3')
+    parser.add_argument('--slow-host', action='append', metavar='HOST=FATTORE',
+                        help="Moltiplica la latenza delle API chiamate su un host, es. 127.0.0.1=10")
+    parser.add_argument('--down-host', action='append', default=[], help='Host le cui API non rispondono')
+    args = parser.parse_args()
+
+    cluster = FakeCluster(nodes=[f'px{i + 1}' for i in range(args.nodes)],
+                          latency=args.latency, clone_seconds=args.clone_seconds, ip_delay=args.ip_delay,
+                          clone_failure_rate=args.clone_failure_rate,
+                          start_failure_rate=args.start_failure_rate,
+                          node_slowness=parse_slowness(args.slow_node),
+                          host_slowness=parse_slowness(args.slow_host), down_hosts=args.down_host)
+    server = start_server(cluster, args.host, args.port)
+    print(f'Finto Proxmox su http://{args.host}:{server.server_port}/api2/json (Ctrl+C per uscire)')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
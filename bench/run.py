@@ -0,0 +1,253 @@
+"""Benchmark del provisioning contro il finto Proxmox di bench/fake_proxmox.py.
+
+    python -m bench.run --mode validate --requests 30 --concurrency 6 --clone-seconds 2
+    python -m bench.run --mode provision --requests 20 --slow-node px2=3
+
+In modalità validate le richieste vengono approvate da /admin/validate/<id> e create
+dal worker di provisioning; in modalità provision i job vengono messi in coda ed eseguiti
+direttamente con run_job, senza passare dalla web app né dal polling della coda.
+Il database è un SQLite temporaneo se non si passa --database-url.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.fake_proxmox import FakeCluster, start_server, parse_slowness
+
+TIERS = ('Bronze', 'Silver', 'Gold')
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+
+def _configure_env(args, port):
+    # Letti all'import di routes.api e services.*: vanno impostati prima di caricare l'app
+    # Configurati solo i primi tre nodi: gli altri li scopre services.topology da /cluster/status
+    os.environ.update({
+        'PROXMOX_HOSTS': '127.0.0.1,127.0.0.2,127.0.0.3',
+        'PROXMOX_NODES': 'px1,px2,px3',
+        'PROXMOX_SCHEME': 'http',
+        'PROXMOX_PORT': str(port),
+        'PX_TOKEN_ID': 'bench@pve!bench',
+        'PX_TOKEN_SECRET': 'bench',
+        'PROVISIONING_NODE_CONCURRENCY': str(args.node_concurrency),
+        'EVENTS_POLL_INTERVAL': '0',
+    })
+
+
+def _create_app(args):
+    from app import create_app
+
+    database_url = args.database_url
+    if database_url is None:
+        database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='ct-bench-'), 'bench.db')}"
+    options = {'connect_args': {'timeout': 30}} if database_url.startswith('sqlite') else {}
+    return create_app({'SQLALCHEMY_DATABASE_URI': database_url, 'SQLALCHEMY_ENGINE_OPTIONS': options,
+                       'SECRET_KEY': 'bench', 'WTF_CSRF_ENABLED': False})
+
+
+def _setup_db(app, args):
+    from models.connection import db
+    from models.model import init_db, Subnet, Role, User
+
+    with app.app_context():
+        db.create_all()
+        init_db()
+        if args.ipam:
+            db.session.add(Subnet(cidr='10.200.0.0/16', gateway='10.200.0.1', bridge='vmbr0'))
+        user = User(username='bench')
+        user.set_password('bench-password')
+        user.roles.append(Role.query.filter_by(name='user').first())
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+def _tier(args, i):
+    return TIERS[i % len(TIERS)] if args.tier == 'mix' else args.tier
+
+
+def _record_samples():
+    """Affianca alle metriche le singole misure, per calcolare percentili esatti."""
+    from services import metrics
+
+    samples = defaultdict(list)
+
+    def wrap(histogram, key):
+        observe = histogram.observe
+
+        def recording_observe(value, **labels):
+            samples[key(labels)].append(value)
+            observe(value, **labels)
+
+        histogram.observe = recording_observe
+
+    wrap(metrics.provisioning_phase_seconds, lambda l: (l['phase'], l['tier'], l['node']))
+    wrap(metrics.provisioning_job_seconds, lambda l: ('job', l['tier'], l['result']))
+    return samples
+
+
+def _add_requests(app, args, user_id):
+    from models.connection import db
+    from models.model import CTRequest, MACHINE_TYPES
+
+    with app.app_context():
+        reqs = []
+        for i in range(args.requests):
+            machine = next(m for m in MACHINE_TYPES if m['name'] == _tier(args, i))
+            reqs.append(CTRequest(user_id=user_id, machine_type=machine['id'], machine_name=machine['name'],
+                                  machine_cpu=machine['cpu'], machine_ram=machine['ram'], status='pending'))
+        db.session.add_all(reqs)
+        db.session.commit()
+        return [req.id for req in reqs]
+
+
+def run_provision(app, args, samples, user_id):
+    from models.connection import db
+    from models.model import CTRequest
+    from services.provisioning import enqueue_provisioning, claim_next_job, run_job
+
+    with app.app_context():
+        for req_id in _add_requests(app, args, user_id):
+            enqueue_provisioning(db.session.get(CTRequest, req_id))
+        db.session.commit()
+
+    def one(_):
+        with app.app_context():
+            job_id = claim_next_job()
+            return job_id is not None and run_job(job_id).get('success', False)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(one, range(args.requests)))
+    return sum(results), len(results) - sum(results), time.monotonic() - started
+
+
+def run_validate(app, args, samples, user_id):
+    from models.connection import db
+    from models.model import CTRequest
+    from services.provisioning import run_worker
+
+    req_ids = _add_requests(app, args, user_id)
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'administrator', 'password': 'Admin123!'})
+
+    threading.Thread(target=run_worker, args=(app,), daemon=True, name='bench-worker',
+                     kwargs={'concurrency': args.concurrency, 'poll_interval': 0.1,
+                             'warm_pool': False, 'inventory': False, 'reconciler': False}).start()
+
+    started = time.monotonic()
+    for req_id in req_ids:
+        response = client.post(f'/admin/validate/{req_id}')
+        if response.status_code != 302:
+            sys.exit(f'validate_ct ha risposto {response.status_code} per la richiesta {req_id}')
+
+    deadline = started + args.timeout
+    while time.monotonic() < deadline:
+        with app.app_context():
+            counts = dict(db.session.execute(
+                db.select(CTRequest.status, db.func.count(CTRequest.id)).group_by(CTRequest.status)
+            ).all())
+        if not counts.get('provisioning'):
+            break
+        time.sleep(0.2)
+    elapsed = time.monotonic() - started
+    return counts.get('approved', 0), counts.get('failed', 0), elapsed
+
+
+def report(args, cluster, samples, approved, failed, elapsed):
+    phases = {}
+    for (phase, tier, node), values in sorted(samples.items()):
+        phases[f'{phase} {tier} {node}'] = {
+            'count': len(values),
+            'p50': percentile(values, 50),
+            'p90': percentile(values, 90),
+            'p99': percentile(values, 99),
+            'max': max(values),
+        }
+    requests = {f'{method} {endpoint}': count for (method, endpoint), count in sorted(cluster.requests.items())}
+    result = {
+        'mode': args.mode,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'approved': approved,
+        'failed': failed,
+        'elapsed_seconds': round(elapsed, 2),
+        'approvals_per_minute': round(approved / elapsed * 60, 1) if elapsed else None,
+        'phases': phases,
+        'proxmox_requests': requests,
+        'proxmox_requests_total': sum(requests.values()),
+    }
+
+    print(f"{args.mode}: {approved} ok, {failed} falliti in {elapsed:.1f}s "
+          f"-> {result['approvals_per_minute']} approvazioni/minuto")
+    print(f"\n{'fase':<32}{'n':>6}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}")
+    for name, stats in phases.items():
+        print(f"{name:<32}{stats['count']:>6}" + ''.join(f'{stats[k]:>9.2f}' for k in ('p50', 'p90', 'p99', 'max')))
+    print(f"\nchiamate Proxmox ({result['proxmox_requests_total']}):")
+    for name, count in requests.items():
+        print(f'  {count:>6}  {name}')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark del provisioning contro un finto Proxmox')
+    parser.add_argument('--mode', choices=('validate', 'provision'), default='validate')
+    parser.add_argument('--requests', type=int, default=30, help='CT da creare')
+    parser.add_argument('--concurrency', type=int, default=6, help='Provisioning in parallelo')
+    parser.add_argument('--node-concurrency', type=int, default=2, help='PROVISIONING_NODE_CONCURRENCY')
+    parser.add_argument('--nodes', type=int, default=3, help='Nodi del finto cluster (almeno 3)')
+    parser.add_argument('--tier', choices=TIERS + ('mix',), default='mix')
+    parser.add_argument('--ipam', action='store_true', help="Assegna gli IP dall'IPAM invece di attenderli dal CT")
+    parser.add_argument('--latency', type=float, default=0.02, help='Secondi di latenza per chiamata Proxmox')
+    parser.add_argument('--clone-seconds', type=float, default=2.0, help='Durata di un clone full')
+    parser.add_argument('--ip-delay', type=float, default=0.0, help='Secondi prima che il CT annunci un IP')
+    parser.add_argument('--clone-failure-rate', type=float, default=0.0)
+    parser.add_argument('--start-failure-rate', type=float, default=0.0)
+    parser.add_argument('--slow-node', action='append', metavar='NODE=FATTORE',
+                        help='Moltiplica latenze e durate su un nodo, es. px2=3')
+    parser.add_argument('--slow-host', action='append', metavar='HOST=FATTORE',
+                        help='Moltiplica la latenza delle API su un host (127.0.0.N per il nodo pxN), es. 127.0.0.1=10')
+    parser.add_argument('--down-host', action='append', default=[], help='Host (127.0.0.N per il nodo pxN) le cui API non rispondono')
+    parser.add_argument('--database-url', help='Database da usare al posto di un SQLite temporaneo (verrà popolato)')
+    parser.add_argument('--timeout', type=float, default=600, help='Attesa massima per il completamento')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json', help='Scrive anche il risultato in questo file JSON')
+    args = parser.parse_args()
+
+    cluster = FakeCluster(nodes=[f'px{i + 1}' for i in range(max(3, args.nodes))], latency=args.latency, clone_seconds=args.clone_seconds, ip_delay=args.ip_delay,
+                          clone_failure_rate=args.clone_failure_rate, start_failure_rate=args.start_failure_rate,
+                          node_slowness=parse_slowness(args.slow_node), host_slowness=parse_slowness(args.slow_host),
+                          down_hosts=args.down_host, seed=args.seed)
+    server = start_server(cluster, host='0.0.0.0')
+    _configure_env(args, server.server_port)
+
+    app = _create_app(args)
+    user_id = _setup_db(app, args)
+    samples = _record_samples()
+
+    if args.mode == 'provision':
+        approved, failed, elapsed = run_provision(app, args, samples, user_id)
+    else:
+        approved, failed, elapsed = run_validate(app, args, samples, user_id)
+
+    report(args, cluster, samples, approved, failed, elapsed)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+import logging
+
+import click
+from flask import current_app
+
+
+def register_cli(app):
+
+    @app.cli.command('seed')
+    def seed():
+        """Crea ruoli e utente administrator; si può rilanciare senza effetti."""
+        from models.model import init_db
+
+        init_db()
+        click.echo('Ruoli e utente administrator presenti')
+
+    @app.cli.command('provision-worker')
+    @click.option('--concurrency', default=6, show_default=True,
+                  help='Provisioning eseguiti in parallelo (almeno nodi x PROVISIONING_NODE_CONCURRENCY).')
+    @click.option('--poll-interval', default=2.0, show_default=True, help='Secondi tra un controllo della coda e il successivo.')
+    @click.option('--warm-pool/--no-warm-pool', default=True, show_default=True,
+                  help='Mantiene pieno il pool di container pre-clonati.')
+    @click.option('--inventory/--no-inventory', default=True, show_default=True,
+                  help="Aggiorna periodicamente l'inventario del cluster.")
+    @click.option('--metrics-port', type=int, default=None,
+                  help='Porta su cui esporre /metrics del worker (disattivato se assente).')
+    @click.option('--reconciler/--no-reconciler', default=True, show_default=True,
+                  help='Elimina i container delle richieste cancellate e quelli orfani.')
+    @click.option('--idle-policy/--no-idle-policy', default=True, show_default=True,
+                  help="Spegne i CT inattivi da più di IDLE_STOP_HOURS (richiede l'inventario).")
+    def provision_worker(concurrency, poll_interval, warm_pool, inventory, metrics_port, reconciler, idle_policy):
+        """Esegue i job di provisioning in coda."""
+        from services.provisioning import run_worker
+
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+        run_worker(current_app._get_current_object(), concurrency=concurrency, poll_interval=poll_interval,
+                   warm_pool=warm_pool, inventory=inventory, metrics_port=metrics_port, reconciler=reconciler,
+                   idle_policy=idle_policy)
+
+    @app.cli.command('provision-resume')
+    @click.option('--older-than', type=float, default=None,
+                  help='Secondi senza heartbeat oltre cui un job è considerato interrotto '
+                       '(default PROVISIONING_STALE_AFTER; 0 dopo il riavvio di un worker unico).')
+    def provision_resume(older_than):
+        """Rimette in coda i job di provisioning interrotti, che ripartono dall'ultimo passo completato."""
+        from datetime import timedelta
+
+        from services.provisioning import requeue_stale_jobs, STALE_AFTER
+
+        stale_after = STALE_AFTER if older_than is None else timedelta(seconds=older_than)
+        click.echo(f'{requeue_stale_jobs(stale_after)} job rimessi in coda')
+
+    @app.cli.command('reconcile')
+    @click.option('--dry-run', is_flag=True, help='Mostra cosa verrebbe eliminato senza eliminare nulla.')
+    def reconcile(dry_run):
+        """Confronta i CT del cluster con il DB ed elimina quelli orfani o di richieste cancellate."""
+        from services.reconciler import reconcile as run_reconcile
+
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+        report = run_reconcile(dry_run=dry_run)
+        if dry_run:
+            for res in report['orphans']:
+                click.echo(f"orfano   {res['ct_vmid']:>6} {res['name']} su {res['node']} ({res['status']})")
+            for d in report['queued']:
+                click.echo(f"in coda  {d['ct_vmid']:>6} {d['reason']} su {d['node'] or '?'} ({d['status']}, "
+                           f"tentativi {d['attempts']}{', ' + d['error'] if d['error'] else ''})")
+            click.echo(f"{len(report['orphans'])} orfani, {len(report['queued'])} eliminazioni in coda")
+        else:
+            click.echo(f"{len(report['orphans'])} orfani trovati, {len(report['destroyed'])} CT eliminati, "
+                       f"{len(report['failed'])} falliti")
+
+    @app.cli.group('warm-pool')
+    def warm_pool():
+        """Gestione del pool di container pre-clonati."""
+
+    @warm_pool.command('refill')
+    def warm_pool_refill():
+        """Clona i container mancanti per riempire il pool."""
+        from services.warm_pool import refill_pool
+
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+        refill_pool()
+
+    @warm_pool.command('status')
+    def warm_pool_status():
+        """Mostra i container del pool per tipo e stato."""
+        from models.connection import db
+        from models.model import WarmContainer
+        from services.warm_pool import POOL_SIZES
+
+        rows = db.session.execute(
+            db.select(WarmContainer.machine_name, WarmContainer.status, db.func.count(WarmContainer.id))
+            .group_by(WarmContainer.machine_name, WarmContainer.status)
+        ).all()
+        for ct_type, size in POOL_SIZES.items():
+            counts = {status: count for name, status, count in rows if name == ct_type}
+            click.echo(f'{ct_type}: target={size} ' + ' '.join(f'{k}={v}' for k, v in sorted(counts.items())))
+
+    @app.cli.group('ipam')
+    def ipam():
+        """Gestione delle subnet e degli indirizzi assegnati ai CT."""
+
+    @ipam.command('add-subnet')
+    @click.argument('cidr')
+    @click.option('--gateway', required=True, help='Gateway della subnet.')
+    @click.option('--bridge', default='vmbr0', show_default=True, help='Bridge Proxmox a cui collegare i CT.')
+    @click.option('--start', help="Primo indirizzo assegnabile (default il primo della subnet).")
+    @click.option('--end', help="Ultimo indirizzo assegnabile (default l'ultimo della subnet).")
+    @click.option('--exclude', help='Indirizzi o intervalli a-b da non assegnare, separati da virgole.')
+    def ipam_add_subnet(cidr, gateway, bridge, start, end, exclude):
+        """Aggiunge una subnet da cui assegnare gli IP ai CT.
+
+        Gli IP dei CT già esistenti che cadono nella subnet vengono registrati come assegnati.
+        """
+        import ipaddress
+
+        from models.connection import db
+        from models.model import Subnet
+        from services.ipam import allocation_range, parse_excluded, seed_leases
+
+        network = ipaddress.ip_network(cidr)
+        for address in (gateway, start, end):
+            if address and ipaddress.ip_address(address) not in network:
+                raise click.BadParameter(f'{address} non appartiene a {network}')
+        try:
+            excluded = parse_excluded(exclude)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='--exclude')
+
+        subnet = Subnet(cidr=str(network), gateway=gateway, bridge=bridge, range_start=start, range_end=end,
+                        excluded=exclude)
+        first, last = allocation_range(subnet)
+        if first is None or last < first:
+            raise click.BadParameter('Intervallo vuoto', param_hint='--start/--end')
+        db.session.add(subnet)
+        db.session.commit()
+        seeded = seed_leases(subnet)
+        click.echo(f'Subnet {network} aggiunta: {first}-{last} ({int(last) - int(first) + 1} indirizzi, '
+                   f'{len(excluded)} esclusi), {seeded} IP di CT esistenti registrati')
+
+    @ipam.command('list')
+    def ipam_list():
+        """Mostra le subnet e quanti indirizzi sono già assegnati."""
+        from models.connection import db
+        from models.model import Subnet
+        from services.ipam import allocation_range
+
+        for subnet in db.session.execute(db.select(Subnet).order_by(Subnet.id)).scalars():
+            first, last = allocation_range(subnet)
+            click.echo(f'{subnet.cidr} gw={subnet.gateway} bridge={subnet.bridge} range={first}-{last} '
+                       f'exclude={subnet.excluded or "-"} leases={subnet.leases.count()}')
+
+    @app.cli.group('inventory')
+    def inventory():
+        """Inventario locale di nodi e container del cluster."""
+
+    @inventory.command('sync')
+    def inventory_sync():
+        """Aggiorna subito l'inventario da /cluster/resources."""
+        from services.inventory import sync_inventory
+
+        if not sync_inventory():
+            raise click.ClickException('Sync inventario fallito')
+        click.echo('Inventario aggiornato')
@@ -0,0 +1,49 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class Config:
+    SQLALCHEMY_DATABASE_URI = os.getenv('SQLALCHEMY_DATABASE_URI')
+    SECRET_KEY = os.getenv('SECRET_KEY', 165465)
+    DEBUG = False
+    TESTING = False
+
+
+class DevConfig(Config):
+    DEBUG = True
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = os.getenv('TEST_DATABASE_URI', 'sqlite://')
+
+
+class ProdConfig(Config):
+    SECRET_KEY = os.getenv('SECRET_KEY')
+    SESSION_COOKIE_HTTPONLY = True
+    REMEMBER_COOKIE_HTTPONLY = True
+    # Le connessioni MySQL inattive vengono chiuse dal server: meglio verificarle e riciclarle
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_pre_ping': True,
+        'pool_recycle': 280,
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 5)),
+    }
+
+
+CONFIGS = {
+    'dev': DevConfig,
+    'test': TestConfig,
+    'prod': ProdConfig,
+}
+
+
+def get_config(name=None):
+    name = name or os.getenv('FLASK_CONFIG', 'dev')
+    try:
+        return CONFIGS[name]
+    except KeyError:
+        raise ValueError(f'Configurazione sconosciuta: {name} (valide: {", ".join(CONFIGS)})')
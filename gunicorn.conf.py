@@ -0,0 +1,28 @@
+# Profilo per il CT del portale: gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Le richieste web ormai sono brevi (il provisioning gira nel worker separato),
+# quindi il collo di bottiglia è la CPU per il rendering e gli hash delle password.
+# - workers: un processo per core più uno, per usare tutti i core senza GIL condiviso
+# - threads: le richieste che aspettano il DB non bloccano il processo. Uno stream SSE invece
+#   tiene un thread per tutta la sua durata: services.events ne apre al massimo
+#   EVENTS_MAX_STREAMS per processo (default GUNICORN_THREADS // 4), le altre dashboard fanno polling
+# - preload_app: l'app si carica una volta nel master e i worker nascono per fork;
+#   create_app non apre connessioni, quindi nessuna connessione viene condivisa dopo il fork
+# Con 2 core: 3 worker x 8 thread = 24 richieste contemporanee.
+# Il pool DB per processo (DB_POOL_SIZE + DB_MAX_OVERFLOW) deve coprire i thread di un worker.
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() + 1))
+# Letto da services.passwords per dividere i core tra i pool di hash dei worker
+os.environ['WEB_CONCURRENCY'] = str(workers)
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+preload_app = True
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+max_requests = 2000
+max_requests_jitter = 200
+accesslog = '-'
@@ -0,0 +1,40 @@
+"""Add provisioning_job table
+
+Revision ID: a1f3c9d2e8b4
+Revises: c3d4e5f6
+Create Date: 2026-01-12 09:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1f3c9d2e8b4'
+down_revision = 'c3d4e5f6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('provisioning_job',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('ct_request_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['ct_request_id'], ['ct_request.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('provisioning_job', schema=None) as batch_op:
+        batch_op.create_index('ix_provisioning_job_status', ['status', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('provisioning_job', schema=None) as batch_op:
+        batch_op.drop_index('ix_provisioning_job_status')
+
+    op.drop_table('provisioning_job')
@@ -0,0 +1,36 @@
+"""Add ct_destruction table
+
+Revision ID: a4c9e2f7b3d6
+Revises: f6b2d8e4c9a1
+Create Date: 2026-04-06 11:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c9e2f7b3d6'
+down_revision = 'f6b2d8e4c9a1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ct_destruction',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('ct_vmid', sa.Integer(), nullable=False),
+    sa.Column('node', sa.String(length=50), nullable=True),
+    sa.Column('reason', sa.String(length=20), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('ct_vmid')
+    )
+
+
+def downgrade():
+    op.drop_table('ct_destruction')
@@ -0,0 +1,28 @@
+"""Add composite indexes for the ct_request dashboards
+
+Revision ID: a6e9c3d5f8b2
+Revises: f4d1b8e6c2a7
+Create Date: 2026-02-23 16:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6e9c3d5f8b2'
+down_revision = 'f4d1b8e6c2a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('ct_request', schema=None) as batch_op:
+        batch_op.create_index('ix_ct_request_status_created_at', ['status', 'created_at'], unique=False)
+        batch_op.create_index('ix_ct_request_user_id_created_at', ['user_id', 'created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('ct_request', schema=None) as batch_op:
+        batch_op.drop_index('ix_ct_request_user_id_created_at')
+        batch_op.drop_index('ix_ct_request_status_created_at')
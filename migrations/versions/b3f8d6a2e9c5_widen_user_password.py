@@ -0,0 +1,34 @@
+"""Widen user.password for scrypt hashes
+
+Revision ID: b3f8d6a2e9c5
+Revises: a6e9c3d5f8b2
+Create Date: 2026-03-02 10:25:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3f8d6a2e9c5'
+down_revision = 'a6e9c3d5f8b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # La colonna è NOT NULL da eb7453a24d50: con existing_nullable=True la copia della tabella
+    # fatta da batch_alter_table su SQLite la renderebbe di nuovo nullable
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password',
+               existing_type=sa.String(length=120),
+               type_=sa.String(length=255),
+               existing_nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password',
+               existing_type=sa.String(length=255),
+               type_=sa.String(length=120),
+               existing_nullable=False)
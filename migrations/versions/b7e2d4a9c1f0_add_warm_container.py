@@ -0,0 +1,33 @@
+"""Add warm_container table
+
+Revision ID: b7e2d4a9c1f0
+Revises: a1f3c9d2e8b4
+Create Date: 2026-01-19 15:02:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2d4a9c1f0'
+down_revision = 'a1f3c9d2e8b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('warm_container',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('ct_vmid', sa.Integer(), nullable=False),
+    sa.Column('node_index', sa.Integer(), nullable=False),
+    sa.Column('machine_name', sa.String(length=50), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('ct_vmid')
+    )
+
+
+def downgrade():
+    op.drop_table('warm_container')
@@ -0,0 +1,32 @@
+"""Add container_activity table
+
+Revision ID: b8d3f1a6c2e9
+Revises: a4c9e2f7b3d6
+Create Date: 2026-04-13 10:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8d3f1a6c2e9'
+down_revision = 'a4c9e2f7b3d6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('container_activity',
+    sa.Column('ct_vmid', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('netin', sa.BigInteger(), nullable=True),
+    sa.Column('netout', sa.BigInteger(), nullable=True),
+    sa.Column('sampled_at', sa.DateTime(), nullable=True),
+    sa.Column('last_active_at', sa.DateTime(), nullable=False),
+    sa.Column('idle_stopped_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('ct_vmid')
+    )
+
+
+def downgrade():
+    op.drop_table('container_activity')
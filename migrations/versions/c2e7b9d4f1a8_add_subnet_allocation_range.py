@@ -0,0 +1,30 @@
+"""Add allocation range and exclusions to subnet
+
+Revision ID: c2e7b9d4f1a8
+Revises: b8d3f1a6c2e9
+Create Date: 2026-04-20 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2e7b9d4f1a8'
+down_revision = 'b8d3f1a6c2e9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('subnet', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('range_start', sa.String(length=50), nullable=True))
+        batch_op.add_column(sa.Column('range_end', sa.String(length=50), nullable=True))
+        batch_op.add_column(sa.Column('excluded', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('subnet', schema=None) as batch_op:
+        batch_op.drop_column('excluded')
+        batch_op.drop_column('range_end')
+        batch_op.drop_column('range_start')
@@ -0,0 +1,26 @@
+"""Add ct_node to ct_request
+
+Revision ID: c5a8e1b3d7f2
+Revises: b7e2d4a9c1f0
+Create Date: 2026-01-26 11:45:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5a8e1b3d7f2'
+down_revision = 'b7e2d4a9c1f0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('ct_request', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('ct_node', sa.String(length=50), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('ct_request', schema=None) as batch_op:
+        batch_op.drop_column('ct_node')
@@ -0,0 +1,30 @@
+"""Add updated_at to ct_request
+
+Revision ID: d1c6b9e4a7f3
+Revises: b3f8d6a2e9c5
+Create Date: 2026-03-16 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd1c6b9e4a7f3'
+down_revision = 'b3f8d6a2e9c5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('ct_request', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_ct_request_updated_at'), ['updated_at'], unique=False)
+
+    op.execute('UPDATE ct_request SET updated_at = created_at')
+
+
+def downgrade():
+    with op.batch_alter_table('ct_request', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_ct_request_updated_at'))
+        batch_op.drop_column('updated_at')
@@ -0,0 +1,26 @@
+"""Add version counter to ct_request
+
+Revision ID: d5a1c8e3b7f4
+Revises: c2e7b9d4f1a8
+Create Date: 2026-04-20 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a1c8e3b7f4'
+down_revision = 'c2e7b9d4f1a8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('ct_request', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('ct_request', schema=None) as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,29 @@
+"""Add ctid_reservation table
+
+Revision ID: d9b4f2c6a8e3
+Revises: c5a8e1b3d7f2
+Create Date: 2026-02-02 10:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9b4f2c6a8e3'
+down_revision = 'c5a8e1b3d7f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ctid_reservation',
+    sa.Column('vmid', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('vmid')
+    )
+
+
+def downgrade():
+    op.drop_table('ctid_reservation')
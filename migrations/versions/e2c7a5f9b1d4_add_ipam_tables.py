@@ -0,0 +1,47 @@
+"""Add subnet and ip_lease tables
+
+Revision ID: e2c7a5f9b1d4
+Revises: d9b4f2c6a8e3
+Create Date: 2026-02-09 14:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2c7a5f9b1d4'
+down_revision = 'd9b4f2c6a8e3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('subnet',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('cidr', sa.String(length=50), nullable=False),
+    sa.Column('gateway', sa.String(length=50), nullable=False),
+    sa.Column('bridge', sa.String(length=50), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('cidr')
+    )
+    op.create_table('ip_lease',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('subnet_id', sa.Integer(), nullable=False),
+    sa.Column('address', sa.String(length=50), nullable=False),
+    sa.Column('ct_vmid', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['subnet_id'], ['subnet.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('address')
+    )
+    with op.batch_alter_table('ip_lease', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_ip_lease_ct_vmid'), ['ct_vmid'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('ip_lease', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_ip_lease_ct_vmid'))
+
+    op.drop_table('ip_lease')
+    op.drop_table('subnet')
@@ -0,0 +1,28 @@
+"""Add fragment_generation table
+
+Revision ID: e7c4a9d2f6b1
+Revises: d5a1c8e3b7f4
+Create Date: 2026-04-20 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7c4a9d2f6b1'
+down_revision = 'd5a1c8e3b7f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('fragment_generation',
+    sa.Column('scope', sa.String(length=64), nullable=False),
+    sa.Column('generation', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('scope')
+    )
+
+
+def downgrade():
+    op.drop_table('fragment_generation')
@@ -0,0 +1,34 @@
+"""Add provisioning steps to ct_request and heartbeat to provisioning_job
+
+Revision ID: e8f3a7c1d5b9
+Revises: d1c6b9e4a7f3
+Create Date: 2026-03-23 10:15:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8f3a7c1d5b9'
+down_revision = 'd1c6b9e4a7f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('ct_request', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('provision_step', sa.String(length=20), nullable=True))
+        batch_op.add_column(sa.Column('provision_upid', sa.String(length=255), nullable=True))
+
+    with op.batch_alter_table('provisioning_job', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('provisioning_job', schema=None) as batch_op:
+        batch_op.drop_column('heartbeat_at')
+
+    with op.batch_alter_table('ct_request', schema=None) as batch_op:
+        batch_op.drop_column('provision_upid')
+        batch_op.drop_column('provision_step')
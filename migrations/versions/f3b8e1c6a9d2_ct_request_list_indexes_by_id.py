@@ -0,0 +1,32 @@
+"""Index the ct_request dashboards by id instead of created_at
+
+Revision ID: f3b8e1c6a9d2
+Revises: e7c4a9d2f6b1
+Create Date: 2026-04-21 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b8e1c6a9d2'
+down_revision = 'e7c4a9d2f6b1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('ct_request', schema=None) as batch_op:
+        batch_op.drop_index('ix_ct_request_user_id_created_at')
+        batch_op.drop_index('ix_ct_request_status_created_at')
+        batch_op.create_index('ix_ct_request_status_id', ['status', 'id'], unique=False)
+        batch_op.create_index('ix_ct_request_user_id_id', ['user_id', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('ct_request', schema=None) as batch_op:
+        batch_op.drop_index('ix_ct_request_user_id_id')
+        batch_op.drop_index('ix_ct_request_status_id')
+        batch_op.create_index('ix_ct_request_status_created_at', ['status', 'created_at'], unique=False)
+        batch_op.create_index('ix_ct_request_user_id_created_at', ['user_id', 'created_at'], unique=False)
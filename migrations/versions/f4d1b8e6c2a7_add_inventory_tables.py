@@ -0,0 +1,57 @@
+"""Add inventory_node and inventory_container tables
+
+Revision ID: f4d1b8e6c2a7
+Revises: e2c7a5f9b1d4
+Create Date: 2026-02-16 09:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4d1b8e6c2a7'
+down_revision = 'e2c7a5f9b1d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('inventory_node',
+    sa.Column('node', sa.String(length=50), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=True),
+    sa.Column('cpu', sa.Float(), nullable=True),
+    sa.Column('maxcpu', sa.Integer(), nullable=True),
+    sa.Column('mem', sa.BigInteger(), nullable=True),
+    sa.Column('maxmem', sa.BigInteger(), nullable=True),
+    sa.Column('disk', sa.BigInteger(), nullable=True),
+    sa.Column('maxdisk', sa.BigInteger(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('node')
+    )
+    op.create_table('inventory_container',
+    sa.Column('vmid', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('node', sa.String(length=50), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=True),
+    sa.Column('type', sa.String(length=10), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=True),
+    sa.Column('template', sa.Boolean(), nullable=False),
+    sa.Column('cpu', sa.Float(), nullable=True),
+    sa.Column('mem', sa.BigInteger(), nullable=True),
+    sa.Column('maxmem', sa.BigInteger(), nullable=True),
+    sa.Column('netin', sa.BigInteger(), nullable=True),
+    sa.Column('netout', sa.BigInteger(), nullable=True),
+    sa.Column('uptime', sa.Integer(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('vmid')
+    )
+    with op.batch_alter_table('inventory_container', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_inventory_container_node'), ['node'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('inventory_container', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_inventory_container_node'))
+
+    op.drop_table('inventory_container')
+    op.drop_table('inventory_node')
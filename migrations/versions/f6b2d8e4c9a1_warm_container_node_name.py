@@ -0,0 +1,49 @@
+"""Store the node name instead of its index on warm_container
+
+Revision ID: f6b2d8e4c9a1
+Revises: e8f3a7c1d5b9
+Create Date: 2026-03-30 09:40:00.000000
+
+"""
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f6b2d8e4c9a1'
+down_revision = 'e8f3a7c1d5b9'
+branch_labels = None
+depends_on = None
+
+# Gli indici salvati finora si riferivano a questa lista
+NODES = os.getenv('PROXMOX_NODES', 'px1,px2,px3').split(',')
+
+
+def upgrade():
+    with op.batch_alter_table('warm_container', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('node', sa.String(length=50), nullable=True))
+
+    warm_container = sa.table('warm_container', sa.column('node_index', sa.Integer), sa.column('node', sa.String))
+    for index, node in enumerate(NODES):
+        op.execute(warm_container.update().where(warm_container.c.node_index == index).values(node=node))
+    op.execute(warm_container.delete().where(warm_container.c.node.is_(None)))
+
+    with op.batch_alter_table('warm_container', schema=None) as batch_op:
+        batch_op.alter_column('node', existing_type=sa.String(length=50), nullable=False)
+        batch_op.drop_column('node_index')
+
+
+def downgrade():
+    with op.batch_alter_table('warm_container', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('node_index', sa.Integer(), nullable=True))
+
+    warm_container = sa.table('warm_container', sa.column('node_index', sa.Integer), sa.column('node', sa.String))
+    for index, node in enumerate(NODES):
+        op.execute(warm_container.update().where(warm_container.c.node == node).values(node_index=index))
+    op.execute(warm_container.delete().where(warm_container.c.node_index.is_(None)))
+
+    with op.batch_alter_table('warm_container', schema=None) as batch_op:
+        batch_op.alter_column('node_index', existing_type=sa.Integer(), nullable=False)
+        batch_op.drop_column('node')
@@ -1,11 +1,30 @@
 from models.connection import db
 from flask_login import UserMixin, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.orm import joinedload, load_only, selectinload
+from services.passwords import hash_password, verify_password
 
+from datetime import datetime
 from functools import wraps
 from flask import abort, redirect, url_for, flash
 
 
+MACHINE_TYPES = [
+    {'id': 'bronze', 'name': 'Bronze', 'cpu': 1, 'ram': 2, 'desc': 'Base CT'},
+    {'id': 'silver', 'name': 'Silver', 'cpu': 2, 'ram': 4, 'desc': 'Med CT'},
+    {'id': 'gold', 'name': 'Gold', 'cpu': 4, 'ram': 8, 'desc': 'High CT'}
+]
+
+
+def parse_tier_values(value, cast=str):
+    """Legge le variabili d'ambiente per tipo di CT, es. 'Bronze=3,Silver=2' -> {'Bronze': 3, 'Silver': 2}."""
+    values = {}
+    for item in value.split(','):
+        if '=' in item:
+            tier, v = item.split('=', 1)
+            values[tier.strip()] = cast(v.strip())
+    return values
+
+
 user_roles = db.Table('user_roles',
     db.Column('user_id', db.Integer, db.ForeignKey('user.id')),
     db.Column('role_id', db.Integer, db.ForeignKey('role.id'))
@@ -23,7 +42,7 @@ class Role(db.Model):
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
-    password = db.Column(db.String(120), nullable=False)
+    password = db.Column(db.String(255), nullable=False)
     roles = db.relationship('Role', 
                             secondary=user_roles, 
                             backref=db.backref('users', lazy='dynamic')
@@ -31,13 +50,21 @@ class User(UserMixin, db.Model):
     ct_requests = db.relationship('CTRequest', backref='user', lazy='dynamic')
 
     def set_password(self, password):
-        self.password = generate_password_hash(password)
+        self.password = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password, password)
+        return verify_password(self.password, password)
+
+    @property
+    def role_names(self):
+        names = self.__dict__.get('_role_names')
+        if names is None:
+            names = frozenset(role.name for role in self.roles)
+            self._role_names = names
+        return names
 
     def has_role(self, role_name):
-        return any(role.name == role_name for role in self.roles)
+        return role_name in self.role_names
 
     def __str__(self):
         return f'User {self.username}'
@@ -45,6 +72,10 @@ class User(UserMixin, db.Model):
 
 class CTRequest(db.Model):
     __tablename__ = 'ct_request'
+    __table_args__ = (
+        db.Index('ix_ct_request_status_id', 'status', 'id'),
+        db.Index('ix_ct_request_user_id_id', 'user_id', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     machine_type = db.Column(db.String(50), nullable=False)
@@ -53,45 +84,241 @@ class CTRequest(db.Model):
     machine_ram = db.Column(db.Integer, nullable=False)
     status = db.Column(db.String(20), nullable=False, default='pending')
     created_at = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+    updated_at = db.Column(db.DateTime, default=db.func.current_timestamp(),
+                           onupdate=db.func.current_timestamp(), index=True)
+    # Incrementata dal DB a ogni UPDATE (anche quelli fatti con db.update()): a differenza di
+    # updated_at, che ha la precisione del secondo, distingue due modifiche ravvicinate
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0',
+                        onupdate=db.literal_column('version') + 1)
 
     ct_ip = db.Column(db.String(50))
     ct_hostname = db.Column(db.String(100))
     ct_user = db.Column(db.String(50))
     ct_password = db.Column(db.String(100))
     ct_vmid = db.Column(db.Integer)
+    ct_node = db.Column(db.String(50))
+    # Ultimo passo di provisioning completato (vedi services.provisioning.STEPS) e task di clone in corso
+    provision_step = db.Column(db.String(20))
+    provision_upid = db.Column(db.String(255))
 
     def __str__(self):
         return f'CTRequest {self.id} - {self.machine_name} - {self.status}'
 
 
-def init_db():
-    if not db.session.execute(db.select(Role).filter_by(name='admin')).scalars().first():
-        admin_role = Role(name='admin')
-        db.session.add(admin_role)
-        db.session.commit()
+PAGE_SIZE = 25
+LIST_COLUMNS = ('id', 'user_id', 'machine_name', 'machine_cpu', 'machine_ram', 'status', 'created_at', 'ct_vmid')
+
+
+def encode_cursor(req):
+    return str(req.id)
+
+
+def decode_cursor(cursor):
+    # Accetta anche i cursori '<created_at>_<id>' delle versioni precedenti
+    try:
+        return int(cursor.rsplit('_', 1)[-1])
+    except (AttributeError, ValueError):
+        return None
+
+
+def page_ct_requests(user_id=None, status=None, tier=None, cursor=None, limit=PAGE_SIZE, with_user=False,
+                     columns=LIST_COLUMNS):
+    """Una pagina di richieste dalla più recente, paginata per id.
+
+    L'id cresce con created_at, che però su SQLite è salvato al secondo ('YYYY-MM-DD HH:MM:SS'):
+    confrontato con un datetime Python le righe dello stesso secondo tornerebbero in ogni pagina.
+
+    Restituisce le righe e il cursore della pagina successiva (None se è l'ultima).
+    """
+    stmt = db.select(CTRequest).options(load_only(*(getattr(CTRequest, c) for c in columns)))
+    if with_user:
+        stmt = stmt.options(joinedload(CTRequest.user).load_only(User.username))
+    if user_id is not None:
+        stmt = stmt.filter(CTRequest.user_id == user_id)
+    if status:
+        stmt = stmt.filter(CTRequest.status == status)
+    if tier:
+        stmt = stmt.filter(CTRequest.machine_name == tier)
+
+    before_id = decode_cursor(cursor) if cursor else None
+    if before_id is not None:
+        stmt = stmt.filter(CTRequest.id < before_id)
+
+    stmt = stmt.order_by(CTRequest.id.desc()).limit(limit + 1)
+    rows = db.session.execute(stmt).scalars().all()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+class ProvisioningJob(db.Model):
+    __tablename__ = 'provisioning_job'
+    __table_args__ = (db.Index('ix_provisioning_job_status', 'status', 'id'),)
+    id = db.Column(db.Integer, primary_key=True)
+    ct_request_id = db.Column(db.Integer, db.ForeignKey('ct_request.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    # Aggiornato dal worker a ogni passo: un job running fermo da troppo è di un worker morto
+    heartbeat_at = db.Column(db.DateTime)
+
+    ct_request = db.relationship('CTRequest',
+                                 backref=db.backref('jobs', lazy='dynamic', cascade='all, delete-orphan'))
+
+    def __str__(self):
+        return f'ProvisioningJob {self.id} - CTRequest {self.ct_request_id} - {self.status}'
+
+
+class WarmContainer(db.Model):
+    __tablename__ = 'warm_container'
+    id = db.Column(db.Integer, primary_key=True)
+    ct_vmid = db.Column(db.Integer, unique=True, nullable=False)
+    node = db.Column(db.String(50), nullable=False)
+    machine_name = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='cloning')
+    created_at = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+
+    def __str__(self):
+        return f'WarmContainer {self.ct_vmid} - {self.machine_name} - {self.status}'
+
+
+class CTIDReservation(db.Model):
+    __tablename__ = 'ctid_reservation'
+    vmid = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    status = db.Column(db.String(20), nullable=False, default='reserved')
+    created_at = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+
+    def __str__(self):
+        return f'CTIDReservation {self.vmid} - {self.status}'
 
-    if not db.session.execute(db.select(Role).filter_by(name='user')).scalars().first():
-        user_role = Role(name='user')
-        db.session.add(user_role)
-        db.session.commit()
 
-    admin_user = db.session.execute(db.select(User).filter_by(username='administrator')).scalars().first()
+class FragmentGeneration(db.Model):
+    """Generazione di uno scope della cache di frammenti in memoria, condivisa tra i processi."""
+    __tablename__ = 'fragment_generation'
+    scope = db.Column(db.String(64), primary_key=True)
+    generation = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ContainerDestruction(db.Model):
+    """CT da spegnere ed eliminare: richieste cancellate e orfani trovati dal reconciler."""
+    __tablename__ = 'ct_destruction'
+    id = db.Column(db.Integer, primary_key=True)
+    ct_vmid = db.Column(db.Integer, unique=True, nullable=False)
+    # Se manca (richieste vecchie senza ct_node) il nodo si ricava dal cluster
+    node = db.Column(db.String(50))
+    reason = db.Column(db.String(20), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+    started_at = db.Column(db.DateTime)
+
+    def __str__(self):
+        return f'ContainerDestruction {self.ct_vmid} - {self.reason} - {self.status}'
+
+
+class Subnet(db.Model):
+    __tablename__ = 'subnet'
+    id = db.Column(db.Integer, primary_key=True)
+    cidr = db.Column(db.String(50), unique=True, nullable=False)
+    gateway = db.Column(db.String(50), nullable=False)
+    bridge = db.Column(db.String(50), nullable=False, default='vmbr0')
+    # Intervallo assegnabile ai CT (vuoto = tutta la subnet) e indirizzi o intervalli a-b da saltare
+    range_start = db.Column(db.String(50))
+    range_end = db.Column(db.String(50))
+    excluded = db.Column(db.Text)
+    leases = db.relationship('IPLease', backref='subnet', lazy='dynamic')
+
+    def __str__(self):
+        return f'Subnet {self.cidr} via {self.gateway}'
+
+
+class IPLease(db.Model):
+    __tablename__ = 'ip_lease'
+    id = db.Column(db.Integer, primary_key=True)
+    subnet_id = db.Column(db.Integer, db.ForeignKey('subnet.id'), nullable=False)
+    address = db.Column(db.String(50), unique=True, nullable=False)
+    ct_vmid = db.Column(db.Integer, index=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+
+    def __str__(self):
+        return f'IPLease {self.address} - CT {self.ct_vmid}'
+
+
+class InventoryNode(db.Model):
+    __tablename__ = 'inventory_node'
+    node = db.Column(db.String(50), primary_key=True)
+    status = db.Column(db.String(20))
+    cpu = db.Column(db.Float)
+    maxcpu = db.Column(db.Integer)
+    mem = db.Column(db.BigInteger)
+    maxmem = db.Column(db.BigInteger)
+    disk = db.Column(db.BigInteger)
+    maxdisk = db.Column(db.BigInteger)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    def __str__(self):
+        return f'InventoryNode {self.node} - {self.status}'
+
+
+class InventoryContainer(db.Model):
+    __tablename__ = 'inventory_container'
+    vmid = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    node = db.Column(db.String(50), nullable=False, index=True)
+    name = db.Column(db.String(100))
+    type = db.Column(db.String(10))
+    status = db.Column(db.String(20))
+    template = db.Column(db.Boolean, nullable=False, default=False)
+    cpu = db.Column(db.Float)
+    mem = db.Column(db.BigInteger)
+    maxmem = db.Column(db.BigInteger)
+    netin = db.Column(db.BigInteger)
+    netout = db.Column(db.BigInteger)
+    uptime = db.Column(db.Integer)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    def __str__(self):
+        return f'InventoryContainer {self.vmid} on {self.node} - {self.status}'
+
+
+class ContainerActivity(db.Model):
+    """Ultimo campione di traffico e CPU di un CT approvato, per capire da quanto è inattivo."""
+    __tablename__ = 'container_activity'
+    ct_vmid = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    netin = db.Column(db.BigInteger)
+    netout = db.Column(db.BigInteger)
+    sampled_at = db.Column(db.DateTime)
+    last_active_at = db.Column(db.DateTime, nullable=False)
+    # Valorizzato quando il CT è stato spento per inattività: va riacceso quando l'utente torna
+    idle_stopped_at = db.Column(db.DateTime)
+
+    def __str__(self):
+        return f'ContainerActivity {self.ct_vmid} - attivo {self.last_active_at}'
+
+
+def init_db():
+    """Crea i ruoli e l'utente administrator se mancano, in un'unica transazione."""
+    roles = {role.name: role for role in db.session.execute(
+        db.select(Role).filter(Role.name.in_(('admin', 'user')))
+    ).scalars()}
+    for name in ('admin', 'user'):
+        if name not in roles:
+            roles[name] = Role(name=name)
+            db.session.add(roles[name])
+
+    admin_user = db.session.execute(
+        db.select(User).options(selectinload(User.roles)).filter_by(username='administrator')
+    ).scalar_one_or_none()
     if not admin_user:
         admin_user = User(username="administrator")
         admin_user.set_password("Admin123!")
-        admin_role = db.session.execute(db.select(Role).filter_by(name='admin')).scalars().first()
-        if admin_role:
-            admin_user.roles.append(admin_role)
         db.session.add(admin_user)
-        db.session.commit()
-    else:
-        admin_role = db.session.execute(db.select(Role).filter_by(name='admin')).scalars().first()
-        if admin_role and not admin_user.has_role('admin'):
-            admin_user.roles.append(admin_role)
-            db.session.commit()
-
-
+    if not admin_user.has_role('admin'):
+        admin_user.roles.append(roles['admin'])
 
+    db.session.commit()
 
 
 def user_has_role(*role_names):
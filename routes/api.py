@@ -1,48 +1,53 @@
-from flask import Blueprint
-import requests
-import urllib3
+from flask import Blueprint, request, jsonify
+from flask_login import current_user
+import hashlib
+import logging
 import os
+import re
+import threading
 import time
+from functools import wraps
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from dotenv import load_dotenv
 
+from models.connection import db
+from models.model import CTRequest, MACHINE_TYPES, page_ct_requests, parse_tier_values, PAGE_SIZE
+from services.hosts import host_for
+from services.metrics import observe_phase, clone_failures, clone_timeouts
+from services.proxmox import get_client
+from services.task_watcher import get_task_watcher
+
 load_dotenv()
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+logger = logging.getLogger(__name__)
 
 app = Blueprint('api', __name__)
 
-PROXMOX_HOSTS = ['192.168.56.15', '192.168.56.16', '192.168.56.17']
-PROXMOX_PORT = 8006
-PROXMOX_TOKEN_ID = os.getenv('PX_TOKEN_ID')
-PROXMOX_TOKEN_SECRET = os.getenv('PX_TOKEN_SECRET')
-PROXMOX_NODES = ['px1', 'px2', 'px3']
+PROXMOX_HOSTS = os.getenv('PROXMOX_HOSTS', '192.168.56.15,192.168.56.16,192.168.56.17').split(',')
+PROXMOX_NODES = os.getenv('PROXMOX_NODES', 'px1,px2,px3').split(',')
 PROXMOX_STORAGE = 'local-lvm'
+# Valori iniziali: services.topology li aggiorna (e aggiunge i nodi nuovi) leggendo il cluster
 PROXMOX_TEMPLATE_IDS = [101, 102, 103]
 CT_TYPE_TO_NODE = {'Gold': 0, 'Silver': 1, 'Bronze': 2}
+CT_DEFAULT_USER = 'root'
+CT_DEFAULT_PASSWORD = 'Password&1'
 
-def get_proxmox_url(host):
-    return f'https://{host}:{PROXMOX_PORT}/api2/json'
-
-def get_auth_headers():
-    return {'Authorization': f'PVEAPIToken={PROXMOX_TOKEN_ID}={PROXMOX_TOKEN_SECRET}'}
-
-def get_next_ctid():
-    host = PROXMOX_HOSTS[0]
-    url = f'{get_proxmox_url(host)}/cluster/nextid'
-    try:
-        r = requests.get(url, headers=get_auth_headers(), verify=False)
-        if r.status_code != 200:
-            return None
-        return int(r.json()['data'])
-    except Exception:
-        return None
 
+# 'full' copia tutto il rootfs del template, 'linked' crea un clone collegato
+# (serve uno storage con snapshot, es. lvmthin o zfs)
+PROVISIONING_MODES = parse_tier_values(os.getenv('PROVISIONING_MODES', 'Bronze=linked,Silver=linked,Gold=full'))
+CLONE_TIMINGS = {'full': {'count': 0, 'seconds': 0.0}, 'linked': {'count': 0, 'seconds': 0.0}}
+_timings_lock = threading.Lock()
+_linked_unsupported = set()
+# Errori con cui Proxmox rifiuta il clone collegato perché lo storage del template non ha gli snapshot
+# (es. "Linked clone feature is not available for drive 'rootfs'"): solo questi fanno passare al full
+LINKED_UNSUPPORTED_RE = re.compile(r'(linked clone|clone feature|snapshot).*(not available|not supported|unsupported)',
+                                   re.IGNORECASE)
 
 def start_container(node_index, ctid):
-    host = PROXMOX_HOSTS[node_index]
+    host = host_for(node_index)
     node = PROXMOX_NODES[node_index]
-    url = f'{get_proxmox_url(host)}/nodes/{node}/lxc/{ctid}/status/start'
     try:
-        r = requests.post(url, headers=get_auth_headers(), verify=False)
+        r = get_client().post(host, f'/nodes/{node}/lxc/{ctid}/status/start')
         if r.status_code != 200:
             try:
                 error_data = r.json()
@@ -54,12 +59,24 @@ def start_container(node_index, ctid):
     except Exception:
         return False
 
+def shutdown_container(node_index, ctid, timeout=60):
+    """Spegnimento pulito del CT; dopo timeout secondi Proxmox lo ferma comunque."""
+    host = host_for(node_index)
+    node = PROXMOX_NODES[node_index]
+    try:
+        r = get_client().post(host, f'/nodes/{node}/lxc/{ctid}/status/shutdown',
+                              data={'timeout': timeout, 'forceStop': 1})
+        return r.status_code == 200
+    except Exception:
+        return False
+
 #ChatGPT Mi ha aiutato per scrivere questa funzione
 def get_container_ip(host, node, ctid, timeout=120):
-    import re, time, os, requests
+    import re
 
     PROXMOX_DEBUG = os.getenv('PROXMOX_DEBUG')
-    url = f'{get_proxmox_url(host)}/nodes/{node}/lxc/{ctid}/interfaces'
+    client = get_client()
+    path = f'/nodes/{node}/lxc/{ctid}/interfaces'
 
     def is_private_ip(ip):
         if ip.startswith('10.') or ip.startswith('192.168.'):
@@ -91,7 +108,7 @@ def get_container_ip(host, node, ctid, timeout=120):
     start = time.time()
     while time.time() - start < timeout:
         try:
-            r = requests.get(url, headers=get_auth_headers(), verify=False)
+            r = client.get(host, path)
             if r.status_code != 200:
                 time.sleep(3)
                 continue
@@ -141,81 +158,344 @@ def get_container_ip(host, node, ctid, timeout=120):
             if candidates: return candidates[0]
 
         if PROXMOX_DEBUG:
-            try: print(f"[PROXMOX DEBUG] URL: {url} RESPONSE: {r.json()}")
-            except Exception: print(f"[PROXMOX DEBUG] URL: {url} RESPONSE TEXT: {r.text}")
+            try: print(f"[PROXMOX DEBUG] URL: {path} RESPONSE: {r.json()}")
+            except Exception: print(f"[PROXMOX DEBUG] URL: {path} RESPONSE TEXT: {r.text}")
 
         time.sleep(3)
 
     return None
 
 
-def clone_container(node_index, new_ctid, ct_type, ip=None):
-    host = PROXMOX_HOSTS[node_index]
+def _error_message(r):
+    try:
+        error_data = r.json()
+        error_msg = error_data.get('message', r.text)
+        if error_data.get('data'):
+            error_msg += f" (Dati: {error_data.get('data')})"
+    except:
+        error_msg = r.text
+    return error_msg
+
+
+def configure_container(node_index, ctid, tier=None, **params):
+    host = host_for(node_index)
+    node = PROXMOX_NODES[node_index]
+    started = time.monotonic()
+    try:
+        r = get_client().put(host, f'/nodes/{node}/lxc/{ctid}/config', data=params)
+        if r.status_code != 200:
+            return {'success': False, 'error': _error_message(r)}
+        return {'success': True}
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+    finally:
+        observe_phase('configure', tier, node, time.monotonic() - started)
+
+
+def _record_clone_timing(mode, seconds):
+    with _timings_lock:
+        timing = CLONE_TIMINGS[mode]
+        timing['count'] += 1
+        timing['seconds'] += seconds
+    logger.info('Clone %s completato in %.1fs (media %.1fs su %s clone)',
+                mode, seconds, timing['seconds'] / timing['count'], timing['count'])
+
+
+def start_clone(node_index, new_ctid, hostname, mode='full', tier=None):
+    """Lancia il clone del template e restituisce subito l'UPID del task Proxmox."""
+    from services.topology import template_for
+
+    host = host_for(node_index)
     node = PROXMOX_NODES[node_index]
-    template_id = PROXMOX_TEMPLATE_IDS[node_index]
-    
+    template_id = template_for(node_index, tier)
+    if template_id is None:
+        return {'success': False, 'error': f'Nessun template per {tier or "i CT"} sul nodo {node}'}
+
+    if mode == 'linked' and node_index in _linked_unsupported:
+        mode = 'full'
+
     params = {
         'newid': new_ctid,
-        'hostname': f'ct-{ct_type.lower()}-{new_ctid}',
-        'storage': PROXMOX_STORAGE,
-        'full': 1,
+        'hostname': hostname,
     }
-    
+    if mode == 'linked':
+        # Il clone collegato resta sullo storage del template, non si può scegliere
+        params['full'] = 0
+    else:
+        params['storage'] = PROXMOX_STORAGE
+        params['full'] = 1
+
     try:
-        url = f'{get_proxmox_url(host)}/nodes/{node}/lxc/{template_id}/clone'
-        r = requests.post(url, headers=get_auth_headers(), data=params, verify=False)
+        r = get_client().post(host, f'/nodes/{node}/lxc/{template_id}/clone', data=params)
+        if r.status_code != 200 and mode == 'linked' and LINKED_UNSUPPORTED_RE.search(_error_message(r)):
+            logger.warning('Clone linked non supportato su %s (%s), uso il clone full',
+                           node, _error_message(r))
+            _linked_unsupported.add(node_index)
+            return start_clone(node_index, new_ctid, hostname, mode='full', tier=tier)
         if r.status_code != 200:
-            try:
-                error_data = r.json()
-                error_msg = error_data.get('message', r.text)
-                if error_data.get('data'):
-                    error_msg += f" (Dati: {error_data.get('data')})"
-            except:
-                error_msg = r.text
-            return {'success': False, 'error': error_msg}
-        
-        upid = r.json()['data']
-        
-        timeout = 300
-        start_time = time.time()
+            clone_failures.inc(node=node, mode=mode)
+            return {'success': False, 'error': _error_message(r)}
+        return {'success': True, 'mode': mode, 'upid': r.json()['data']}
+    except Exception as e:
+        clone_failures.inc(node=node, mode=mode)
+        return {'success': False, 'error': str(e)}
+
+
+def wait_clone(node_index, upid, mode='full', tier=None, started=None, timeout=300, on_wait=None,
+               wait_interval=30):
+    """Attende la fine del task di clone; on_wait viene chiamata ogni wait_interval secondi di attesa.
+
+    Un timeout non dice nulla sull'esito del task: il clone può ancora finire e si può riattendere.
+    """
+    host = host_for(node_index)
+    node = PROXMOX_NODES[node_index]
+    waiting_since = time.monotonic()
+    watch = get_task_watcher().watch(host, node, upid)
+    try:
         while True:
-            url_task = f'{get_proxmox_url(host)}/nodes/{node}/tasks/{upid}/status'
-            r_task = requests.get(url_task, headers=get_auth_headers(), verify=False)
-            task_data = r_task.json().get('data', {})
-            
-            if task_data.get('status') == 'stopped':
-                if task_data.get('exitstatus') == 'OK':
-                    break
-                return {'success': False, 'error': f"Clone fallito, exitstatus={task_data.get('exitstatus')}"}
-            
-            if time.time() - start_time > timeout:
-                return {'success': False, 'error': 'Timeout clone'}
-            
-            time.sleep(2)
-        
-        if not start_container(node_index, new_ctid):
-            return {'success': False, 'error': 'Avvio container fallito'}
-        
-        ip_real = get_container_ip(host, node, new_ctid) or ip
-        
-        return {
-            'success': True,
-            'ct_vmid': new_ctid,
-            'ip': ip_real,
-            'ct_user': 'root',
-            'ct_password': 'Password&1'
-        }
+            remaining = waiting_since + timeout - time.monotonic()
+            try:
+                task_data = watch.result(timeout=max(min(wait_interval, remaining), 0))
+                break
+            except FutureTimeoutError:
+                if remaining <= wait_interval:
+                    get_task_watcher().forget(upid)
+                    clone_timeouts.inc(node=node, mode=mode)
+                    return {'success': False, 'timeout': True, 'error': 'Timeout clone'}
+                if on_wait is not None:
+                    on_wait()
+
+        if task_data.get('exitstatus') != 'OK':
+            clone_failures.inc(node=node, mode=mode)
+            return {'success': False, 'error': f"Clone fallito, exitstatus={task_data.get('exitstatus')}"}
+
+        elapsed = time.monotonic() - (started or waiting_since)
+        if started is not None:
+            _record_clone_timing(mode, elapsed)
+        observe_phase('clone_wait', tier, node, elapsed)
+        return {'success': True, 'mode': mode}
     except Exception as e:
+        clone_failures.inc(node=node, mode=mode)
         return {'success': False, 'error': str(e)}
 
-def create_ct(ct_type, node_index=None, ip=None):
-    if node_index is None:
-        node_index = CT_TYPE_TO_NODE.get(ct_type)
-        if node_index is None:
-            return {'success': False, 'error': f'Tipo CT {ct_type} non valido'}
 
-    ctid = get_next_ctid()
-    if ctid is None:
-        return {'success': False, 'error': 'Impossibile ottenere CTID'}
+def clone_template(node_index, new_ctid, hostname, mode='full', tier=None):
+    started = time.monotonic()
+    result = start_clone(node_index, new_ctid, hostname, mode=mode, tier=tier)
+    if not result['success']:
+        return result
+    result = wait_clone(node_index, result['upid'], mode=result['mode'], tier=tier, started=started)
+    # Il task è partito: anche se è fallito può aver lasciato un CT con questo ctid
+    result['clone_started'] = True
+    return result
+
+
+def container_status(node_index, ctid):
+    """Stato corrente del CT secondo Proxmox (running, stopped, ...), None se non disponibile."""
+    host = host_for(node_index)
+    node = PROXMOX_NODES[node_index]
+    try:
+        r = get_client().get(host, f'/nodes/{node}/lxc/{ctid}/status/current')
+        if r.status_code != 200:
+            return None
+        return r.json().get('data', {}).get('status')
+    except Exception:
+        return None
+
+
+def _wait_task(host, node, upid, timeout):
+    try:
+        return get_task_watcher().watch(host, node, upid).result(timeout=timeout)
+    except FutureTimeoutError:
+        get_task_watcher().forget(upid)
+        return {'exitstatus': 'timeout'}
+
+
+def destroy_container(node_index, ctid, timeout=120):
+    """Spegne il CT se è acceso e lo elimina con i suoi dischi; se non esiste più è già fatto."""
+    host = host_for(node_index)
+    node = PROXMOX_NODES[node_index]
+    client = get_client()
+    try:
+        r = client.get(host, f'/nodes/{node}/lxc/{ctid}/status/current')
+        if r.status_code != 200:
+            if 'does not exist' in _error_message(r):
+                return {'success': True, 'gone': True}
+            return {'success': False, 'error': _error_message(r)}
+
+        if r.json().get('data', {}).get('status') == 'running':
+            r = client.post(host, f'/nodes/{node}/lxc/{ctid}/status/stop')
+            if r.status_code != 200:
+                return {'success': False, 'error': _error_message(r)}
+            task_data = _wait_task(host, node, r.json()['data'], timeout)
+            if task_data.get('exitstatus') != 'OK':
+                return {'success': False, 'error': f"Stop fallito, exitstatus={task_data.get('exitstatus')}"}
+
+        r = client.delete(host, f'/nodes/{node}/lxc/{ctid}', params={'purge': 1, 'destroy-unreferenced-disks': 1})
+        if r.status_code != 200:
+            return {'success': False, 'error': _error_message(r)}
+        task_data = _wait_task(host, node, r.json()['data'], timeout)
+        if task_data.get('exitstatus') != 'OK':
+            return {'success': False, 'error': f"Eliminazione fallita, exitstatus={task_data.get('exitstatus')}"}
+        return {'success': True, 'gone': False}
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+
+def node_index_for(node):
+    if node not in PROXMOX_NODES:
+        # Nodo aggiunto al cluster dopo l'ultima lettura della topologia
+        from services.topology import ensure_topology
+
+        ensure_topology(max_age=30)
+    try:
+        return PROXMOX_NODES.index(node)
+    except ValueError:
+        return None
+
+
+API_FIELDS = ('id', 'user_id', 'machine_type', 'machine_name', 'machine_cpu', 'machine_ram', 'status',
+              'created_at', 'updated_at', 'version', 'ct_ip', 'ct_hostname', 'ct_user', 'ct_vmid', 'ct_node')
+# Servono sempre: cursore della pagina successiva ed ETag
+KEY_FIELDS = ('id', 'created_at', 'version')
+MAX_PAGE_SIZE = 200
+
+
+def api_login_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return jsonify(error='Autenticazione richiesta'), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def _requested_fields():
+    fields = request.args.get('fields')
+    if not fields:
+        return API_FIELDS
+    return tuple(f for f in API_FIELDS if f in set(fields.split(',')))
+
+
+def _serialize(req, fields):
+    data = {}
+    for field in fields:
+        value = getattr(req, field)
+        data[field] = value.isoformat() if hasattr(value, 'isoformat') else value
+    return data
+
+
+def _etag(parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def _conditional(payload, etag):
+    # Niente Last-Modified: updated_at ha la precisione del secondo e un If-Modified-Since
+    # nasconderebbe le modifiche fatte nello stesso secondo; l'ETag viene da CTRequest.version
+    response = jsonify(payload)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def _scope_user_id():
+    return None if current_user.has_role('admin') else current_user.id
+
+
+@app.route('/requests')
+@api_login_required
+def list_requests():
+    fields = _requested_fields()
+    limit = min(request.args.get('limit', PAGE_SIZE, type=int), MAX_PAGE_SIZE)
+    rows, next_cursor = page_ct_requests(
+        user_id=_scope_user_id(),
+        status=request.args.get('status') or None,
+        tier=request.args.get('tier') or None,
+        cursor=request.args.get('cursor'),
+        limit=max(limit, 1),
+        columns=tuple(dict.fromkeys(KEY_FIELDS + fields)),
+    )
+    etag = _etag((fields, next_cursor, [(r.id, r.version) for r in rows]))
+    if request.if_none_match.contains(etag):
+        return _conditional({}, etag)
+    return _conditional({'requests': [_serialize(r, fields) for r in rows], 'next_cursor': next_cursor}, etag)
+
+
+@app.route('/requests/<int:req_id>')
+@api_login_required
+def get_request(req_id):
+    # Prima solo la versione della riga: se il client ce l'ha già basta un 304
+    stmt = db.select(CTRequest.version).filter(CTRequest.id == req_id)
+    scope = _scope_user_id()
+    if scope is not None:
+        stmt = stmt.filter(CTRequest.user_id == scope)
+    version = db.session.execute(stmt).first()
+    if version is None:
+        return jsonify(error='Richiesta non trovata'), 404
+
+    fields = _requested_fields()
+    etag = _etag((fields, req_id, version.version))
+    if request.if_none_match.contains(etag):
+        return _conditional({}, etag)
+    req = db.session.get(CTRequest, req_id)
+    return _conditional(_serialize(req, fields), etag)
+
+
+@app.route('/requests', methods=['POST'])
+@api_login_required
+def create_request():
+    data = request.get_json(silent=True) or {}
+    machine = next((m for m in MACHINE_TYPES if m['id'] == data.get('machine_type')), None)
+    if not machine:
+        return jsonify(error='Tipo macchina non valido',
+                       valid=[m['id'] for m in MACHINE_TYPES]), 400
+
+    ct_request = CTRequest(
+        user_id=current_user.id,
+        machine_type=machine['id'],
+        machine_name=machine['name'],
+        machine_cpu=machine['cpu'],
+        machine_ram=machine['ram'],
+        status='pending'
+    )
+    db.session.add(ct_request)
+    db.session.commit()
+
+    from services.events import notify_request_changed
+    from services.fragment_cache import invalidate_requests
+
+    invalidate_requests(ct_request)
+    notify_request_changed(ct_request)
+    return jsonify(_serialize(ct_request, API_FIELDS)), 201
+
+
+@app.route('/requests/status', methods=['POST'])
+@api_login_required
+def requests_status():
+    data = request.get_json(silent=True) or {}
+    ids = [i for i in data.get('ids', []) if isinstance(i, int)][:MAX_PAGE_SIZE]
+    stmt = db.select(CTRequest.id, CTRequest.status, CTRequest.ct_ip, CTRequest.updated_at, CTRequest.version)\
+        .filter(CTRequest.id.in_(ids)).order_by(CTRequest.id)
+    scope = _scope_user_id()
+    if scope is not None:
+        stmt = stmt.filter(CTRequest.user_id == scope)
+    rows = db.session.execute(stmt).all()
+
+    etag = _etag([(r.id, r.version) for r in rows])
+    payload = {'requests': [{'id': r.id, 'status': r.status, 'ct_ip': r.ct_ip, 'version': r.version,
+                             'updated_at': r.updated_at.isoformat() if r.updated_at else None}
+                            for r in rows],
+               'missing': sorted(set(ids) - {r.id for r in rows})}
+    return _conditional(payload, etag)
+
+
+@app.route('/fragment-cache')
+@api_login_required
+def fragment_cache_stats():
+    if not current_user.has_role('admin'):
+        return jsonify(error='Operazione non autorizzata'), 403
+
+    from services.fragment_cache import get_fragment_cache
 
-    return clone_container(node_index, ctid, ct_type, ip=ip) 
+    return jsonify(get_fragment_cache().info())
@@ -12,6 +12,7 @@ from flask_login import login_required
 from flask_login import login_user
 from flask_login import logout_user
 from models.model import user_has_role
+from services.passwords import needs_rehash, PasswordHashBusy
 
 
 
@@ -37,10 +38,22 @@ def login_post():
     if not user:
         flash(f'Utente "{username}" non trovato')
         return redirect(url_for('auth.login'))
-    if not user.check_password(password):
+    try:
+        valid = user.check_password(password)
+    except PasswordHashBusy:
+        flash('Troppi accessi contemporanei, riprova tra qualche secondo')
+        return redirect(url_for('auth.login'))
+    if not valid:
         flash('Password errata')
         return redirect(url_for('auth.login'))
 
+    try:
+        if needs_rehash(user.password):
+            user.set_password(password)
+            db.session.commit()
+    except PasswordHashBusy:
+        pass
+
     login_user(user, remember=remember)
     flash(f'Benvenuto {user.username}!')
     return redirect(url_for('ct.ct_dashboard'))  
@@ -81,7 +94,11 @@ def signup_post():
         return redirect(url_for('auth.signup'))
     
     new_user = User(username=username)
-    new_user.set_password(password)
+    try:
+        new_user.set_password(password)
+    except PasswordHashBusy:
+        flash('Troppe registrazioni contemporanee, riprova tra qualche secondo')
+        return redirect(url_for('auth.signup'))
     new_user.roles.append(user_role)
     
     db.session.add(new_user)
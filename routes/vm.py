@@ -1,30 +1,74 @@
-from flask import Blueprint, render_template, redirect, url_for, request, flash
+from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, Response, stream_with_context
 from flask_login import login_required, current_user
-from models.model import user_has_role, CTRequest, User
+from markupsafe import Markup
+from models.model import user_has_role, page_ct_requests, CTRequest, User, MACHINE_TYPES
 from models.connection import db
-from routes.api import create_ct, get_container_ip, PROXMOX_HOSTS, PROXMOX_NODES, CT_TYPE_TO_NODE
+from services.provisioning import enqueue_provisioning
+from services.reconciler import queue_destruction
+from services.idle import wake_on_access
+from services.inventory import get_container_states, get_container_state
+from services.events import (notify_request_changed, stream_request_events, poll_request_events,
+                             acquire_stream_slot, release_stream_slot)
+from services.fragment_cache import get_fragment_cache, invalidate_requests, user_scope, ADMIN_SCOPE
+from routes.api import get_container_ip, node_index_for, PROXMOX_NODES, CT_TYPE_TO_NODE
+from services.hosts import host_for
 
 from datetime import datetime
 
 app = Blueprint('ct', __name__)
 
-MACHINE_TYPES = [
-    {'id': 'bronze', 'name': 'Bronze', 'cpu': 1, 'ram': 2, 'desc': 'Base CT'},
-    {'id': 'silver', 'name': 'Silver', 'cpu': 2, 'ram': 4, 'desc': 'Med CT'},
-    {'id': 'gold', 'name': 'Gold', 'cpu': 4, 'ram': 8, 'desc': 'High CT'}
-]
-
 @app.route('/dashboard')
 @login_required
 def ct_dashboard():
     if current_user.has_role('admin'):
         return redirect(url_for('ct.admin_ct_dashboard'))
 
-    ct_requests = CTRequest.query.filter_by(user_id=current_user.id)\
-        .order_by(CTRequest.created_at.desc()).all()
+    cursor = request.args.get('cursor')
+
+    def render_list():
+        ct_requests, next_cursor = page_ct_requests(user_id=current_user.id, cursor=cursor)
+        ct_states = get_container_states([r.ct_vmid for r in ct_requests])
+        return render_template('_request_list.html', requests=ct_requests, ct_states=ct_states,
+                               next_cursor=next_cursor, cursor=cursor)
+
+    request_list = get_fragment_cache().get_or_render(user_scope(current_user.id), cursor or '', render_list)
     return render_template('dashboard.html', 
                          machine_types=MACHINE_TYPES, 
-                         requests=ct_requests)
+                         request_list=Markup(request_list))
+
+def _event_stream(**kwargs):
+    if not acquire_stream_slot():
+        # 204 ferma le riconnessioni di EventSource: la pagina passa al polling di /events/poll
+        return Response(status=204)
+    response = Response(stream_with_context(stream_request_events(**kwargs)), mimetype='text/event-stream')
+    response.call_on_close(release_stream_slot)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _event_poll(**kwargs):
+    since = request.args.get('since')
+    try:
+        since = datetime.fromisoformat(since) if since else None
+    except ValueError:
+        since = None
+    response = jsonify(poll_request_events(since, **kwargs))
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.route('/events')
+@login_required
+def ct_events():
+    return _event_stream(user_id=current_user.id)
+
+
+@app.route('/events/poll')
+@login_required
+def ct_events_poll():
+    return _event_poll(user_id=current_user.id)
+
 
 @app.route('/request_ct', methods=['POST'])
 @login_required
@@ -47,6 +91,8 @@ def request_ct():
     
     db.session.add(ct_request)
     db.session.commit()
+    invalidate_requests(ct_request)
+    notify_request_changed(ct_request)
     
     flash('Richiesta inviata, in attesa di approvazione')
     return redirect(url_for('ct.ct_dashboard'))
@@ -55,8 +101,30 @@ def request_ct():
 @login_required
 @user_has_role('admin')
 def admin_ct_dashboard():
-    requests = CTRequest.query.order_by(CTRequest.created_at.desc()).all()
-    return render_template('admin_dashboard.html', requests=requests) 
+    status = request.args.get('status') or None
+    tier = request.args.get('tier') or None
+    cursor = request.args.get('cursor')
+
+    def render_list():
+        requests, next_cursor = page_ct_requests(status=status, tier=tier, cursor=cursor, with_user=True)
+        ct_states = get_container_states([r.ct_vmid for r in requests])
+        return render_template('_admin_request_list.html', requests=requests, ct_states=ct_states,
+                               next_cursor=next_cursor, status=status, tier=tier, cursor=cursor)
+
+    request_list = get_fragment_cache().get_or_render(ADMIN_SCOPE, f'{status}|{tier}|{cursor}', render_list)
+    return render_template('admin_dashboard.html', request_list=Markup(request_list), status=status, tier=tier)
+
+@app.route('/admin/events')
+@login_required
+@user_has_role('admin')
+def admin_ct_events():
+    return _event_stream(admin=True)
+
+@app.route('/admin/events/poll')
+@login_required
+@user_has_role('admin')
+def admin_ct_events_poll():
+    return _event_poll(admin=True)
 
 @app.route('/admin/validate/<int:req_id>', methods=['POST'])
 @login_required
@@ -64,26 +132,54 @@ def admin_ct_dashboard():
 def validate_ct(req_id):
     req = CTRequest.query.get_or_404(req_id)
 
-    if req.status != 'pending':
+    if req.status not in ('pending', 'failed'):
         flash('Richiesta già processata')
         return redirect(url_for('ct.admin_ct_dashboard'))
-    
-    ct_type = req.machine_name
-    result = create_ct(ct_type)
-    
-    if result.get('success'):
-        req.status = 'approved'
-        req.ct_ip = result['ip']
-        req.ct_hostname = f'ct-{ct_type.lower()}-{result["ct_vmid"]}'
-        req.ct_user = result['ct_user']
-        req.ct_password = result['ct_password']
-        req.ct_vmid = result['ct_vmid']
-        
-        db.session.commit()
-        flash('CT creata e approvata con successo')
+
+    enqueue_provisioning(req)
+    db.session.commit()
+    invalidate_requests(req)
+    notify_request_changed(req)
+    flash('Richiesta approvata, creazione CT in corso')
+
+    return redirect(url_for('ct.admin_ct_dashboard'))
+
+
+@app.route('/admin/validate/bulk', methods=['POST'])
+@login_required
+@user_has_role('admin')
+def validate_ct_bulk():
+    req_ids = request.form.getlist('req_ids', type=int)
+    tier = request.form.get('tier')
+
+    query = CTRequest.query.filter(CTRequest.status.in_(('pending', 'failed')))
+    if req_ids:
+        query = query.filter(CTRequest.id.in_(req_ids))
+    elif tier:
+        query = query.filter(CTRequest.status == 'pending', CTRequest.machine_name == tier)
     else:
-        flash(f'Errore nella creazione del CT: {result.get("error", "Errore sconosciuto")}')
-    
+        flash('Seleziona almeno una richiesta o un tipo di CT')
+        return redirect(url_for('ct.admin_ct_dashboard'))
+
+    found = {req.id: req for req in query.all()}
+    for req in found.values():
+        enqueue_provisioning(req)
+    db.session.commit()
+    invalidate_requests(*found.values())
+    for req in found.values():
+        notify_request_changed(req)
+
+    results = [{'id': req_id, 'success': True, 'status': 'provisioning'} for req_id in found]
+    results += [{'id': req_id, 'success': False, 'error': 'Richiesta inesistente o già processata'}
+                for req_id in req_ids if req_id not in found]
+
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(results=results)
+
+    flash(f'{len(found)} richieste approvate, creazione CT in corso')
+    for result in results:
+        if not result['success']:
+            flash(f"Richiesta {result['id']}: {result['error']}")
     return redirect(url_for('ct.admin_ct_dashboard'))
 
 
@@ -92,12 +188,14 @@ def validate_ct(req_id):
 @user_has_role('admin')
 def reject_ct(req_id):
     req = CTRequest.query.get_or_404(req_id)
-    if req.status != 'pending':
+    if req.status not in ('pending', 'failed'):
         flash('Richiesta già processata')
         return redirect(url_for('ct.admin_ct_dashboard'))
 
     req.status = 'rejected'
     db.session.commit()
+    invalidate_requests(req)
+    notify_request_changed(req)
     flash('Richiesta rifiutata')
     return redirect(url_for('ct.admin_ct_dashboard'))
 
@@ -114,13 +212,19 @@ def delete_ct_request(req_id):
         flash("L'admin può eliminare solo richieste rifiutate")
         return redirect(url_for('ct.admin_ct_dashboard'))
 
-    if req.status == 'approved' and req.user_id == current_user.id:
-        flash('Impossibile eliminare una CT approvata')
+    if req.status == 'provisioning':
+        flash('Impossibile eliminare una CT in fase di creazione')
         return redirect(url_for('ct.ct_dashboard'))
 
+    # Il CT (o il clone rimasto a metà di una richiesta fallita) lo elimina il worker,
+    # che poi libera anche IP e CTID
+    if req.ct_vmid:
+        queue_destruction(req.ct_vmid, req.ct_node)
     db.session.delete(req)
     db.session.commit()
-    flash('Richiesta eliminata')
+    invalidate_requests(req)
+    notify_request_changed(req, deleted=True)
+    flash('Richiesta eliminata, il container verrà eliminato a breve' if req.ct_vmid else 'Richiesta eliminata')
     if current_user.has_role('admin'):
         return redirect(url_for('ct.admin_ct_dashboard'))
 
@@ -140,13 +244,19 @@ def ct_access_details(req_id):
         flash('Accesso non disponibile')
         return redirect(url_for('ct.ct_dashboard'))
     
+    state = get_container_state(req.ct_vmid)
+    # Se era stato spento per inattività si riaccende mentre l'utente legge i dati
+    if req.ct_vmid and state != 'missing' and wake_on_access(req, state):
+        state = 'in avvio'
+
     access = {
         'ip': req.ct_ip,
         'hostname': req.ct_hostname,
         'user': req.ct_user,
         'password': req.ct_password,
         'ct_vmid': req.ct_vmid,
-        'req_id': req.id
+        'req_id': req.id,
+        'state': state
     }
     
     return render_template('access_details.html', access=access) 
@@ -168,12 +278,19 @@ def refresh_ct_ip(req_id):
         flash('CT ID non disponibile')
         return redirect(url_for('ct.ct_access_details', req_id=req_id))
 
-    node_index = CT_TYPE_TO_NODE.get(req.machine_name)
+    if get_container_state(req.ct_vmid) == 'missing':
+        flash('CT non trovata nel cluster')
+        return redirect(url_for('ct.ct_access_details', req_id=req_id))
+
+    if req.ct_node:
+        node_index = node_index_for(req.ct_node)
+    else:
+        node_index = CT_TYPE_TO_NODE.get(req.machine_name)
     if node_index is None:
         flash('Impossibile determinare il nodo della CT')
         return redirect(url_for('ct.ct_access_details', req_id=req_id))
 
-    host = PROXMOX_HOSTS[node_index]
+    host = host_for(node_index)
     node = PROXMOX_NODES[node_index]
     ip = get_container_ip(host, node, req.ct_vmid, timeout=5)
     if ip:
@@ -0,0 +1,91 @@
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy.exc import IntegrityError
+
+from models.connection import db
+from models.model import CTIDReservation
+from services.hosts import cluster_get
+
+logger = logging.getLogger(__name__)
+
+CTID_RANGE_START = int(os.getenv('CTID_RANGE_START', 1000))
+CTID_RANGE_END = int(os.getenv('CTID_RANGE_END', 9999))
+CLUSTER_SYNC_TTL = float(os.getenv('CTID_CLUSTER_SYNC_TTL', 60))
+
+_cluster_vmids = set()
+_cluster_synced_at = None
+_lock = threading.Lock()
+
+
+def cluster_vmids():
+    """Id già usati nel cluster, riletti da /cluster/resources al massimo ogni CLUSTER_SYNC_TTL secondi."""
+    global _cluster_vmids, _cluster_synced_at
+    now = time.monotonic()
+    with _lock:
+        if _cluster_synced_at is not None and now - _cluster_synced_at < CLUSTER_SYNC_TTL:
+            return _cluster_vmids
+
+    try:
+        r = cluster_get('/cluster/resources', params={'type': 'vm'})
+        if r.status_code == 200:
+            vmids = {int(res['vmid']) for res in r.json().get('data', []) if 'vmid' in res}
+            with _lock:
+                _cluster_vmids, _cluster_synced_at = vmids, now
+    except Exception as e:
+        logger.warning('Sync degli id del cluster fallito: %s', e)
+    return _cluster_vmids
+
+
+def reserve_ctid():
+    used = set(cluster_vmids())
+    used.update(db.session.execute(
+        db.select(CTIDReservation.vmid)
+        .filter(CTIDReservation.vmid.between(CTID_RANGE_START, CTID_RANGE_END))
+    ).scalars())
+
+    for vmid in range(CTID_RANGE_START, CTID_RANGE_END + 1):
+        if vmid in used:
+            continue
+        # La chiave primaria rende la prenotazione atomica: chi perde la corsa riceve
+        # un IntegrityError e passa all'id successivo
+        db.session.add(CTIDReservation(vmid=vmid, status='reserved'))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            continue
+        return vmid
+
+    logger.error('Nessun CTID libero tra %s e %s', CTID_RANGE_START, CTID_RANGE_END)
+    return None
+
+
+def mark_ctid_used(vmid):
+    db.session.execute(
+        db.update(CTIDReservation).where(CTIDReservation.vmid == vmid).values(status='used')
+    )
+    db.session.commit()
+
+
+def release_ctid(vmid):
+    """Libera il CTID di un CT che non esiste più nel cluster (eliminato o mai creato)."""
+    db.session.execute(db.delete(CTIDReservation).where(CTIDReservation.vmid == vmid))
+    db.session.commit()
+    with _lock:
+        _cluster_vmids.discard(vmid)
+
+
+def release_unused_ctid(vmid):
+    """Libera il CTID di un clone che Proxmox ha rifiutato prima di avviare il task.
+
+    Nessun CT è stato creato, ma il rifiuto può voler dire che l'id è già occupato da un CT che la
+    cache non conosce ancora: il prossimo reserve_ctid rilegge il cluster prima di riassegnarlo.
+    """
+    global _cluster_synced_at
+    db.session.execute(db.delete(CTIDReservation).where(CTIDReservation.vmid == vmid))
+    db.session.commit()
+    with _lock:
+        _cluster_synced_at = None
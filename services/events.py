@@ -0,0 +1,174 @@
+import json
+import os
+import queue
+import threading
+import time
+from datetime import timedelta
+
+from flask import render_template
+
+from models.connection import db
+from models.model import CTRequest
+
+# Ogni quanto lo stream rilegge dal DB le richieste modificate da altri processi
+# (worker di provisioning, altri worker gunicorn); 0 lascia solo il pub/sub in memoria
+EVENTS_POLL_INTERVAL = float(os.getenv('EVENTS_POLL_INTERVAL', 3))
+EVENTS_HEARTBEAT = 15
+# Gli stream si chiudono dopo un po' per liberare il thread; EventSource si riconnette da solo
+EVENTS_MAX_DURATION = float(os.getenv('EVENTS_MAX_DURATION', 300))
+# Ogni stream tiene occupato un thread gthread finché resta aperto: oltre questo numero per
+# processo il server risponde 204 e la dashboard passa al polling di /events/poll
+EVENTS_MAX_STREAMS = int(os.getenv('EVENTS_MAX_STREAMS', max(1, int(os.getenv('GUNICORN_THREADS', 8)) // 4)))
+# Secondi tra due richieste delle dashboard in polling
+EVENTS_CLIENT_POLL_INTERVAL = int(os.getenv('EVENTS_CLIENT_POLL_INTERVAL', 10))
+
+_stream_slots = threading.BoundedSemaphore(EVENTS_MAX_STREAMS)
+
+
+def acquire_stream_slot():
+    return _stream_slots.acquire(blocking=False)
+
+
+def release_stream_slot():
+    _stream_slots.release()
+
+
+class EventBroker:
+    """Pub/sub in processo: ogni stream aperto riceve gli id delle richieste modificate."""
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        q = queue.Queue(maxsize=1000)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(q)
+        return q
+
+    def unsubscribe(self, channel, q):
+        with self._lock:
+            subscribers = self._subscribers.get(channel)
+            if subscribers:
+                subscribers.discard(q)
+                if not subscribers:
+                    del self._subscribers[channel]
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                pass
+
+
+broker = EventBroker()
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+ADMIN_CHANNEL = 'admin'
+
+
+def notify_request_changed(req, deleted=False):
+    event = {'id': req.id, 'deleted': deleted}
+    broker.publish(user_channel(req.user_id), event)
+    broker.publish(ADMIN_CHANNEL, event)
+
+
+def _sse(data):
+    return f'data: {json.dumps(data)}\n\n'
+
+
+def _render_rows(req_ids, user_id, admin):
+    stmt = db.select(CTRequest).filter(CTRequest.id.in_(req_ids))
+    if user_id is not None:
+        stmt = stmt.filter(CTRequest.user_id == user_id)
+    rows = db.session.execute(stmt).scalars().all()
+
+    from services.inventory import get_container_states
+
+    ct_states = get_container_states([r.ct_vmid for r in rows])
+    partial = '_admin_request_row.html' if admin else '_request_row.html'
+    return [{'id': r.id, 'version': r.version, 'status': r.status, 'ct_ip': r.ct_ip,
+             'html': render_template(partial, r=r, ct_states=ct_states)}
+            for r in rows]
+
+
+def _changed_since(since, scope):
+    # Un secondo di margine: updated_at ha la precisione del secondo (e su SQLite il confronto tra
+    # stringhe escluderebbe lo stesso secondo); le righe già inviate si riconoscono da version
+    stmt = db.select(CTRequest.id, CTRequest.version).filter(CTRequest.updated_at >= since - timedelta(seconds=1))
+    if scope is not None:
+        stmt = stmt.filter(CTRequest.user_id == scope)
+    return db.session.execute(stmt).all()
+
+
+def poll_request_events(since=None, user_id=None, admin=False):
+    """Alternativa allo stream per il polling: righe modificate da since (incluso) e nuovo cursore.
+
+    Le righe modificate a cavallo di since tornano anche alla richiesta successiva: il client le
+    scarta confrontando version.
+    """
+    now = db.session.execute(db.select(db.func.current_timestamp())).scalar()
+    events = []
+    if since is not None:
+        scope = None if admin else user_id
+        ids = [req_id for req_id, _ in _changed_since(since, scope)]
+        if ids:
+            events = _render_rows(ids, scope, admin)
+    return {'events': events, 'since': now.isoformat(), 'interval': EVENTS_CLIENT_POLL_INTERVAL}
+
+
+def stream_request_events(user_id=None, admin=False):
+    """Generatore SSE con le righe aggiornate delle richieste di un utente o, per l'admin, di tutti."""
+    channel = ADMIN_CHANNEL if admin else user_channel(user_id)
+    q = broker.subscribe(channel)
+    scope = None if admin else user_id
+    since = db.session.execute(db.select(db.func.current_timestamp())).scalar()
+    db.session.close()
+    seen = {}
+    started = last_poll = last_sent = time.monotonic()
+
+    try:
+        yield 'retry: 5000\n\n'
+        while time.monotonic() - started < EVENTS_MAX_DURATION:
+            timeout = EVENTS_POLL_INTERVAL or EVENTS_HEARTBEAT
+            changed, deleted = set(), set()
+            try:
+                event = q.get(timeout=timeout)
+                (deleted if event['deleted'] else changed).add(event['id'])
+            except queue.Empty:
+                pass
+
+            if EVENTS_POLL_INTERVAL and time.monotonic() - last_poll >= EVENTS_POLL_INTERVAL:
+                last_poll = time.monotonic()
+                poll_started = db.session.execute(db.select(db.func.current_timestamp())).scalar()
+                # updated_at ha la precisione del secondo: le righe dell'ultimo secondo si rileggono
+                # e si inviano solo se version è cambiata da quella già inviata
+                for req_id, version in _changed_since(since, scope):
+                    if seen.get(req_id) != version:
+                        seen[req_id] = version
+                        changed.add(req_id)
+                since = poll_started
+
+            for req_id in deleted:
+                yield _sse({'id': req_id, 'deleted': True})
+            if changed - deleted:
+                for data in _render_rows(changed - deleted, scope, admin):
+                    seen[data['id']] = data['version']
+                    yield _sse(data)
+            # Nessuna connessione tenuta aperta tra un controllo e l'altro
+            db.session.close()
+
+            if deleted or changed:
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= EVENTS_HEARTBEAT:
+                last_sent = time.monotonic()
+                yield ': ping\n\n'
+    finally:
+        broker.unsubscribe(channel, q)
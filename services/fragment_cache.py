@@ -0,0 +1,171 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from services.metrics import fragment_cache_hits, fragment_cache_misses
+
+FRAGMENT_CACHE_MAX_BYTES = int(os.getenv('FRAGMENT_CACHE_MAX_BYTES', 8 * 1024 * 1024))
+# Lo stato dei CT (running/stopped) arriva dall'inventario e non invalida la cache: il TTL ne limita il ritardo
+FRAGMENT_CACHE_TTL = float(os.getenv('FRAGMENT_CACHE_TTL', 30))
+# Es. redis://localhost:6379/0 per condividere la cache tra i worker gunicorn e il worker di provisioning
+FRAGMENT_CACHE_URL = os.getenv('FRAGMENT_CACHE_URL')
+
+ADMIN_SCOPE = 'admin'
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+class MemoryBackend:
+    """LRU in processo limitata in byte. Le generazioni stanno nel DB: un'invalidazione fatta da un
+    worker gunicorn (o dal worker di provisioning) vale subito anche per le copie degli altri processi."""
+
+    def __init__(self, max_bytes=FRAGMENT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires, size = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                self.size -= size
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        size = sys.getsizeof(key) + sys.getsizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[2]
+            self._entries[key] = (value, time.monotonic() + ttl, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+
+    def counter(self, key):
+        from models.connection import db
+        from models.model import FragmentGeneration
+
+        return db.session.scalar(
+            db.select(FragmentGeneration.generation).filter_by(scope=key)) or 0
+
+    def incr(self, key):
+        from sqlalchemy.exc import IntegrityError
+
+        from models.connection import db
+        from models.model import FragmentGeneration
+
+        for _ in range(2):
+            updated = db.session.execute(
+                db.update(FragmentGeneration).filter_by(scope=key)
+                .values(generation=FragmentGeneration.generation + 1)).rowcount
+            if not updated:
+                db.session.add(FragmentGeneration(scope=key, generation=1))
+            try:
+                db.session.commit()
+                break
+            except IntegrityError:
+                # Lo stesso scope creato in contemporanea da un altro processo: si ripete l'UPDATE
+                db.session.rollback()
+        return self.counter(key)
+
+    def info(self):
+        return {'backend': 'memory', 'entries': len(self._entries), 'bytes': self.size,
+                'max_bytes': self.max_bytes}
+
+
+class RedisBackend:
+    """Backend condiviso: il limite di memoria è quello di Redis (maxmemory con allkeys-lru)."""
+
+    def __init__(self, url, prefix='ct-fragments:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return value.decode() if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, value.encode(), ex=max(int(ttl), 1))
+
+    def counter(self, key):
+        return int(self.client.get(self.prefix + 'gen:' + key) or 0)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + 'gen:' + key)
+
+    def info(self):
+        return {'backend': 'redis'}
+
+
+class FragmentCache:
+    """Frammenti HTML per scope (utente o admin); invalidare uno scope ne incrementa la generazione,
+    così le chiavi vecchie non vengono più lette e finiscono espulse dalla LRU."""
+
+    def __init__(self, backend, ttl=FRAGMENT_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def get_or_render(self, scope, variant, render):
+        key = f'{scope}:{self.backend.counter(scope)}:{variant}'
+        value = self.backend.get(key)
+        # Etichetta solo admin/user: un valore per utente renderebbe le serie illimitate
+        kind = scope.split(':', 1)[0]
+        if value is not None:
+            self._count('hits')
+            fragment_cache_hits.inc(scope=kind)
+            return value
+        self._count('misses')
+        fragment_cache_misses.inc(scope=kind)
+        value = render()
+        self.backend.set(key, value, self.ttl)
+        return value
+
+    def invalidate(self, *scopes):
+        for scope in scopes:
+            self.backend.incr(scope)
+            self._count('invalidations')
+
+    def info(self):
+        return dict(self.stats, **self.backend.info())
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_fragment_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                backend = RedisBackend(FRAGMENT_CACHE_URL) if FRAGMENT_CACHE_URL else MemoryBackend()
+                _cache = FragmentCache(backend)
+    return _cache
+
+
+def invalidate_requests(*reqs):
+    """Da chiamare dopo ogni modifica delle richieste: invalida le liste dei proprietari e dell'admin."""
+    get_fragment_cache().invalidate(ADMIN_SCOPE, *{user_scope(req.user_id) for req in reqs})
@@ -0,0 +1,174 @@
+import logging
+import os
+import threading
+import time
+
+from services.metrics import registry, Gauge
+from services.proxmox import get_client
+
+logger = logging.getLogger(__name__)
+
+HOST_CHECK_INTERVAL = float(os.getenv('PROXMOX_HOST_CHECK_INTERVAL', 10))
+# Errori consecutivi che aprono il circuito e secondi prima di riprovare l'host
+CIRCUIT_FAILURES = int(os.getenv('PROXMOX_CIRCUIT_FAILURES', 3))
+CIRCUIT_OPEN_SECONDS = float(os.getenv('PROXMOX_CIRCUIT_OPEN_SECONDS', 30))
+EWMA_ALPHA = 0.2
+# Proxmox risponde 500 anche per errori applicativi (CT già esistente, ...): solo questi indicano un host in difficoltà
+UNHEALTHY_STATUS = (502, 503, 504, 595, 596)
+
+host_latency = registry.register(Gauge(
+    'proxmox_host_latency_ewma_seconds', 'Media mobile della latenza delle API per host', ('host',)))
+host_circuit_open = registry.register(Gauge(
+    'proxmox_host_circuit_open', '1 se il circuito verso l host è aperto', ('host',)))
+
+
+class _HostState:
+    def __init__(self):
+        self.latency = None
+        self.failures = 0
+        self.open_until = None
+
+
+class HostSelector:
+    """Sceglie l'host Proxmox a cui mandare le chiamate in base a latenza media e salute.
+
+    Ogni risposta del client aggiorna la media mobile della latenza dell'host; dopo
+    CIRCUIT_FAILURES errori consecutivi il circuito si apre e l'host viene evitato per
+    CIRCUIT_OPEN_SECONDS, poi la prima chiamata (o il controllo periodico) lo riprova.
+    """
+
+    def __init__(self, client, hosts, check_interval=HOST_CHECK_INTERVAL, failures=CIRCUIT_FAILURES,
+                 open_seconds=CIRCUIT_OPEN_SECONDS):
+        self.client = client
+        self.hosts = list(hosts)
+        self.check_interval = check_interval
+        self.failures = failures
+        self.open_seconds = open_seconds
+        self._states = {host: _HostState() for host in self.hosts}
+        self._lock = threading.Lock()
+        self._thread = None
+        client.listeners.append(self.record)
+
+    def update_hosts(self, hosts):
+        """Allinea la lista agli host scoperti dalla topologia; le statistiche di quelli noti restano."""
+        with self._lock:
+            for host in hosts:
+                self._states.setdefault(host, _HostState())
+            self.hosts = list(hosts)
+
+    def record(self, host, seconds, status_code=None, error=None):
+        state = self._states.get(host)
+        if state is None:
+            return
+        ok = error is None and status_code not in UNHEALTHY_STATUS
+        with self._lock:
+            if ok:
+                state.latency = seconds if state.latency is None else \
+                    EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * state.latency
+                if state.open_until is not None:
+                    logger.info('Host Proxmox %s di nuovo disponibile', host)
+                state.failures = 0
+                state.open_until = None
+            else:
+                state.failures += 1
+                if state.failures >= self.failures:
+                    if state.open_until is None:
+                        logger.warning('Host Proxmox %s escluso dopo %s errori (%s)',
+                                       host, state.failures, error or status_code)
+                    state.open_until = time.monotonic() + self.open_seconds
+            latency, open_ = state.latency, state.open_until is not None
+        if latency is not None:
+            host_latency.set(latency, host=host)
+        host_circuit_open.set(1 if open_ else 0, host=host)
+
+    def is_available(self, host):
+        state = self._states.get(host)
+        return state is None or state.open_until is None or state.open_until <= time.monotonic()
+
+    def ranked_hosts(self):
+        """Host disponibili dal più veloce; senza misure vale l'ordine degli host.
+        Se sono tutti esclusi li restituisce comunque, dal primo che tornerà disponibile."""
+        self._ensure_checker()
+        with self._lock:
+            available = [h for h in self.hosts if self.is_available(h)]
+            if not available:
+                return sorted(self.hosts, key=lambda h: self._states[h].open_until)
+            return sorted(available, key=lambda h: (self._states[h].latency is None,
+                                                    self._states[h].latency or 0, self.hosts.index(h)))
+
+    def cluster_host(self):
+        return self.ranked_hosts()[0]
+
+    def host_for(self, node_index):
+        """Host per le chiamate /nodes/<nodo>: il suo, o se è escluso un altro host del cluster che le inoltra."""
+        if node_index >= len(self.hosts):
+            # Nodo appena scoperto dalla topologia e non ancora passato da update_hosts
+            return self.cluster_host()
+        host = self.hosts[node_index]
+        if self.is_available(host):
+            return host
+        return self.cluster_host()
+
+    def cluster_get(self, path, attempts=None, **kwargs):
+        """GET sulle API di cluster con failover sugli altri host; solleva l'ultimo errore se falliscono tutti.
+
+        Niente retry sullo stesso host: il tentativo successivo va già a un altro host.
+        """
+        last_error = None
+        r = None
+        for host in self.ranked_hosts()[:attempts or len(self.hosts)]:
+            try:
+                r = self.client.probe(host, path, **kwargs)
+            except Exception as e:
+                last_error = e
+                continue
+            if r.status_code not in UNHEALTHY_STATUS:
+                return r
+        if r is not None:
+            return r
+        raise last_error
+
+    def check_hosts(self):
+        for host in self.hosts:
+            try:
+                self.client.probe(host, '/version')
+            except Exception as e:
+                logger.debug('Controllo di %s fallito: %s', host, e)
+
+    def _run_checker(self):
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                self.check_hosts()
+            except Exception:
+                logger.exception('Errore nel controllo degli host Proxmox')
+
+    def _ensure_checker(self):
+        if self.check_interval and (self._thread is None or not self._thread.is_alive()):
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run_checker, name='proxmox-hosts', daemon=True)
+                    self._thread.start()
+
+
+_selector = None
+_selector_lock = threading.Lock()
+
+
+def get_host_selector():
+    global _selector
+    if _selector is None:
+        with _selector_lock:
+            if _selector is None:
+                from routes.api import PROXMOX_HOSTS
+
+                _selector = HostSelector(get_client(), PROXMOX_HOSTS)
+    return _selector
+
+
+def host_for(node_index):
+    return get_host_selector().host_for(node_index)
+
+
+def cluster_get(path, **kwargs):
+    return get_host_selector().cluster_get(path, **kwargs)
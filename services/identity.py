@@ -0,0 +1,55 @@
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached, selectinload
+
+from models.connection import db
+from models.model import User
+
+IDENTITY_CACHE_TTL = float(os.getenv('IDENTITY_CACHE_TTL', 30))
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def load_identity(user_id):
+    """Utente con i ruoli per Flask-Login, dalla cache se caricato da meno di IDENTITY_CACHE_TTL secondi."""
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+
+    now = time.monotonic()
+    with _lock:
+        cached = _cache.get(user_id)
+    if cached and cached[0] > now:
+        _, username, role_names = cached
+        user = User(id=user_id, username=username)
+        # Agganciato alla sessione senza query; gli altri attributi si caricano solo se usati
+        make_transient_to_detached(user)
+        user = db.session.merge(user, load=False)
+        user._role_names = role_names
+        return user
+
+    user = db.session.execute(
+        db.select(User).options(selectinload(User.roles)).filter_by(id=user_id)
+    ).scalar_one_or_none()
+    if user is not None and IDENTITY_CACHE_TTL > 0:
+        with _lock:
+            _cache[user_id] = (now + IDENTITY_CACHE_TTL, user.username, user.role_names)
+    return user
+
+
+def invalidate_identity(user_id):
+    with _lock:
+        _cache.pop(user_id, None)
+
+
+@event.listens_for(User.roles, 'append')
+@event.listens_for(User.roles, 'remove')
+def _roles_changed(user, role, initiator):
+    user.__dict__.pop('_role_names', None)
+    if user.id is not None:
+        invalidate_identity(user.id)
@@ -0,0 +1,135 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from models.connection import db
+from models.model import ContainerActivity, CTRequest, InventoryContainer, parse_tier_values
+from routes.api import shutdown_container, start_container, node_index_for, CT_TYPE_TO_NODE
+from services.inventory import is_fresh
+from services.metrics import registry, Counter
+
+logger = logging.getLogger(__name__)
+
+IDLE_CHECK_INTERVAL = float(os.getenv('IDLE_CHECK_INTERVAL', 60))
+# Ore senza attività dopo cui il CT viene spento, per tipo (0 = mai)
+IDLE_STOP_HOURS = parse_tier_values(os.getenv('IDLE_STOP_HOURS', 'Bronze=24,Silver=72,Gold=0'), float)
+# Sotto queste soglie il campione conta come inattivo: CPU in frazione dei core del CT, rete in byte/s
+IDLE_CPU_THRESHOLD = float(os.getenv('IDLE_CPU_THRESHOLD', 0.05))
+IDLE_NET_THRESHOLD = float(os.getenv('IDLE_NET_THRESHOLD', 2048))
+# CT spenti al massimo per giro, dai più inattivi
+IDLE_STOP_BATCH = int(os.getenv('IDLE_STOP_BATCH', 10))
+
+idle_stops = registry.register(Counter(
+    'idle_stops_total', 'CT spenti per inattività', ('tier',)))
+idle_wakes = registry.register(Counter(
+    'idle_wakes_total', "CT riaccesi all'apertura dei dati di accesso", ('tier',)))
+
+
+def _node_index(req):
+    if req.ct_node:
+        return node_index_for(req.ct_node)
+    return CT_TYPE_TO_NODE.get(req.machine_name)
+
+
+def _is_active(activity, inv):
+    if (inv.cpu or 0) >= IDLE_CPU_THRESHOLD:
+        return True
+    if activity.sampled_at is None or activity.netin is None or inv.updated_at <= activity.sampled_at:
+        return False
+    traffic = (inv.netin or 0) - activity.netin + (inv.netout or 0) - (activity.netout or 0)
+    if traffic < 0:
+        # Contatori azzerati: il CT è stato riavviato nel frattempo
+        return True
+    return traffic / (inv.updated_at - activity.sampled_at).total_seconds() >= IDLE_NET_THRESHOLD
+
+
+def check_idle():
+    """Aggiorna l'ultima attività dei CT approvati dall'inventario e spegne quelli inattivi da troppo.
+
+    I campioni (CPU e contatori di rete) arrivano tutti dalla GET /cluster/resources del sync
+    dell'inventario: nessuna chiamata per singolo CT. Con l'inventario non aggiornato non si decide nulla.
+    """
+    if not is_fresh():
+        return []
+    rows = db.session.execute(
+        db.select(CTRequest, InventoryContainer, ContainerActivity)
+        .join(InventoryContainer, InventoryContainer.vmid == CTRequest.ct_vmid)
+        .outerjoin(ContainerActivity, ContainerActivity.ct_vmid == CTRequest.ct_vmid)
+        .filter(CTRequest.status == 'approved')
+    ).all()
+
+    now = datetime.utcnow()
+    idle = []
+    for req, inv, activity in rows:
+        if activity is None:
+            activity = ContainerActivity(ct_vmid=req.ct_vmid, last_active_at=now)
+            db.session.add(activity)
+        if inv.status != 'running':
+            continue
+        if _is_active(activity, inv):
+            activity.last_active_at = now
+            activity.idle_stopped_at = None
+        activity.netin, activity.netout, activity.sampled_at = inv.netin, inv.netout, inv.updated_at
+
+        idle_hours = IDLE_STOP_HOURS.get(req.machine_name, 0)
+        if idle_hours and now - activity.last_active_at >= timedelta(hours=idle_hours):
+            idle.append((req, activity))
+    db.session.commit()
+
+    stopped = []
+    for req, activity in sorted(idle, key=lambda item: item[1].last_active_at)[:IDLE_STOP_BATCH]:
+        node_index = _node_index(req)
+        if node_index is None or not shutdown_container(node_index, req.ct_vmid):
+            logger.warning('Spegnimento del CT %s inattivo fallito', req.ct_vmid)
+            continue
+        logger.info('CT %s (%s) spento dopo %s di inattività', req.ct_vmid, req.machine_name,
+                    now - activity.last_active_at)
+        activity.idle_stopped_at = now
+        idle_stops.inc(tier=req.machine_name)
+        stopped.append(req.ct_vmid)
+    db.session.commit()
+    return stopped
+
+
+def wake_on_access(req, state=None):
+    """L'utente apre i dati di accesso: conta come attività e riaccende il CT se era spento.
+
+    Restituisce True se il CT è stato avviato.
+    """
+    activity = db.session.get(ContainerActivity, req.ct_vmid)
+    now = datetime.utcnow()
+    started = False
+    if state == 'stopped' or (activity is not None and activity.idle_stopped_at is not None):
+        node_index = _node_index(req)
+        started = node_index is not None and start_container(node_index, req.ct_vmid)
+        if not started:
+            logger.warning('Riavvio su richiesta del CT %s fallito', req.ct_vmid)
+    if activity is None:
+        activity = ContainerActivity(ct_vmid=req.ct_vmid, last_active_at=now)
+        db.session.add(activity)
+    activity.last_active_at = now
+    if started:
+        # I contatori ripartono da zero: il prossimo campione fa solo da base
+        activity.idle_stopped_at = None
+        activity.netin = activity.netout = activity.sampled_at = None
+        idle_wakes.inc(tier=req.machine_name)
+    db.session.commit()
+    return started
+
+
+def run_idle_policy(app, interval=IDLE_CHECK_INTERVAL):
+    while True:
+        try:
+            with app.app_context():
+                check_idle()
+        except Exception:
+            logger.exception('Errore nel controllo dei CT inattivi')
+        time.sleep(interval)
+
+
+def start_idle_policy(app, interval=IDLE_CHECK_INTERVAL):
+    thread = threading.Thread(target=run_idle_policy, args=(app, interval), name='idle-policy', daemon=True)
+    thread.start()
+    return thread
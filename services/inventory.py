@@ -0,0 +1,95 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from models.connection import db
+from models.model import InventoryContainer, InventoryNode
+from services.hosts import cluster_get
+
+logger = logging.getLogger(__name__)
+
+SYNC_INTERVAL = float(os.getenv('INVENTORY_SYNC_INTERVAL', 15))
+# Oltre questo ritardo l'inventario non è più affidabile e le lookup non rispondono
+STALE_AFTER = timedelta(seconds=SYNC_INTERVAL * 4)
+
+NODE_FIELDS = ('status', 'cpu', 'maxcpu', 'mem', 'maxmem', 'disk', 'maxdisk')
+CONTAINER_FIELDS = ('node', 'name', 'type', 'status', 'cpu', 'mem', 'maxmem', 'netin', 'netout', 'uptime')
+
+
+def sync_inventory():
+    """Aggiorna nodi e container con una sola GET /cluster/resources."""
+    r = cluster_get('/cluster/resources')
+    if r.status_code != 200:
+        logger.warning('Sync inventario fallito: HTTP %s', r.status_code)
+        return False
+    resources = r.json().get('data', [])
+    now = datetime.utcnow()
+
+    nodes = {}
+    containers = {}
+    for res in resources:
+        if res.get('type') == 'node':
+            nodes[res['node']] = {f: res.get(f) for f in NODE_FIELDS}
+        elif res.get('type') in ('lxc', 'qemu') and 'vmid' in res:
+            data = {f: res.get(f) for f in CONTAINER_FIELDS}
+            data['template'] = bool(res.get('template'))
+            containers[int(res['vmid'])] = data
+
+    for node, data in nodes.items():
+        db.session.merge(InventoryNode(node=node, updated_at=now, **data))
+    for vmid, data in containers.items():
+        db.session.merge(InventoryContainer(vmid=vmid, updated_at=now, **data))
+
+    db.session.execute(db.delete(InventoryNode).where(InventoryNode.node.not_in(list(nodes))))
+    db.session.execute(db.delete(InventoryContainer).where(InventoryContainer.vmid.not_in(list(containers))))
+    db.session.commit()
+    return True
+
+
+def last_synced_at():
+    return db.session.execute(db.select(db.func.max(InventoryNode.updated_at))).scalar()
+
+
+def is_fresh():
+    synced_at = last_synced_at()
+    return synced_at is not None and datetime.utcnow() - synced_at < STALE_AFTER
+
+
+def get_container_states(vmids):
+    """Stato dei CT indicati (running, stopped, missing); vuoto se l'inventario non è aggiornato."""
+    vmids = [vmid for vmid in vmids if vmid]
+    if not vmids or not is_fresh():
+        return {}
+    found = dict(db.session.execute(
+        db.select(InventoryContainer.vmid, InventoryContainer.status)
+        .filter(InventoryContainer.vmid.in_(vmids))
+    ).all())
+    return {vmid: found.get(vmid, 'missing') for vmid in vmids}
+
+
+def get_container_state(vmid):
+    return get_container_states([vmid]).get(vmid)
+
+
+def get_nodes():
+    if not is_fresh():
+        return {}
+    return {n.node: n for n in db.session.execute(db.select(InventoryNode)).scalars()}
+
+
+def run_syncer(app, interval=SYNC_INTERVAL):
+    while True:
+        try:
+            with app.app_context():
+                sync_inventory()
+        except Exception:
+            logger.exception("Errore nel sync dell'inventario")
+        time.sleep(interval)
+
+
+def start_syncer(app, interval=SYNC_INTERVAL):
+    thread = threading.Thread(target=run_syncer, args=(app, interval), name='inventory', daemon=True)
+    thread.start()
+    return thread
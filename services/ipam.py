@@ -0,0 +1,106 @@
+import ipaddress
+import logging
+
+from sqlalchemy.exc import IntegrityError
+
+from models.connection import db
+from models.model import CTRequest, Subnet, IPLease
+
+logger = logging.getLogger(__name__)
+
+
+def parse_excluded(value):
+    """Indirizzi da non assegnare: "a.b.c.d" o intervalli "a.b.c.d-a.b.c.e" separati da virgole."""
+    excluded = set()
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        first, _, last = item.partition('-')
+        first = ipaddress.ip_address(first.strip())
+        last = ipaddress.ip_address(last.strip()) if last else first
+        excluded.update(str(ipaddress.ip_address(n)) for n in range(int(first), int(last) + 1))
+    return excluded
+
+
+def allocation_range(subnet):
+    network = ipaddress.ip_network(subnet.cidr)
+    hosts = network.hosts()
+    first = ipaddress.ip_address(subnet.range_start) if subnet.range_start else next(hosts, None)
+    last = ipaddress.ip_address(subnet.range_end) if subnet.range_end else network.broadcast_address - 1
+    return first, last
+
+
+def _addresses_in_use():
+    """Indirizzi occupati fuori dall'IPAM: host Proxmox e CT che hanno preso l'IP via DHCP."""
+    from routes.api import PROXMOX_HOSTS
+
+    used = set(PROXMOX_HOSTS)
+    used.update(db.session.execute(
+        db.select(CTRequest.ct_ip).filter(CTRequest.ct_ip.isnot(None))
+    ).scalars())
+    return used
+
+
+def allocate_ip(ct_vmid):
+    """Assegna al CT il primo indirizzo libero delle subnet configurate, None se non ce ne sono."""
+    in_use = _addresses_in_use()
+    for subnet in db.session.execute(db.select(Subnet).order_by(Subnet.id)).scalars():
+        leased = set(db.session.execute(
+            db.select(IPLease.address).filter_by(subnet_id=subnet.id)
+        ).scalars())
+        leased.add(subnet.gateway)
+        leased |= in_use | parse_excluded(subnet.excluded)
+
+        first, last = allocation_range(subnet)
+        if first is None:
+            continue
+        for n in range(int(first), int(last) + 1):
+            address = str(ipaddress.ip_address(n))
+            if address in leased:
+                continue
+            lease = IPLease(subnet_id=subnet.id, address=address, ct_vmid=ct_vmid)
+            db.session.add(lease)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                continue
+            return lease
+
+    logger.warning('Nessun indirizzo IP libero per il CT %s', ct_vmid)
+    return None
+
+
+def seed_leases(subnet):
+    """Registra come lease gli IP dei CT già creati che cadono nella subnet; restituisce quanti."""
+    network = ipaddress.ip_network(subnet.cidr)
+    leased = set(db.session.execute(db.select(IPLease.address)).scalars())
+    seeded = 0
+    for ct_vmid, ct_ip in db.session.execute(
+        db.select(CTRequest.ct_vmid, CTRequest.ct_ip).filter(CTRequest.ct_ip.isnot(None))
+    ).all():
+        try:
+            address = ipaddress.ip_address(ct_ip)
+        except ValueError:
+            continue
+        if address in network and str(address) not in leased:
+            db.session.add(IPLease(subnet_id=subnet.id, address=str(address), ct_vmid=ct_vmid))
+            leased.add(str(address))
+            seeded += 1
+    db.session.commit()
+    return seeded
+
+
+def net0_config(lease):
+    prefix = ipaddress.ip_network(lease.subnet.cidr).prefixlen
+    return f'name=eth0,bridge={lease.subnet.bridge},ip={lease.address}/{prefix},gw={lease.subnet.gateway}'
+
+
+def release_ip(ct_vmid):
+    db.session.execute(db.delete(IPLease).where(IPLease.ct_vmid == ct_vmid))
+    db.session.commit()
+
+
+def lease_for(ct_vmid):
+    return db.session.execute(db.select(IPLease).filter_by(ct_vmid=ct_vmid)).scalars().first()
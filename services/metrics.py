@@ -0,0 +1,245 @@
+import hmac
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+
+# Formato di esposizione testuale di Prometheus, senza dipendenze esterne.
+# Le metriche sono per processo: web e worker di provisioning si raccolgono separatamente.
+# Senza METRICS_TOKEN /metrics non viene esposto: i conteggi per nodo e tipo non sono pubblici
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PHASE_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, '')) for n in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            items = sorted(self._values.items())
+            lines += self._render_samples(items)
+        return lines
+
+    def _render_samples(self, items):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {value}' for key, value in items]
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=HTTP_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def _render_samples(self, items):
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', bound)])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.monotonic() - self.started, **self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+proxmox_request_seconds = registry.register(Histogram(
+    'proxmox_request_seconds', 'Durata delle chiamate alle API Proxmox',
+    ('method', 'endpoint', 'host')))
+proxmox_request_errors = registry.register(Counter(
+    'proxmox_request_errors_total', 'Chiamate Proxmox fallite (HTTP non 2xx o eccezione)',
+    ('method', 'endpoint', 'host', 'reason')))
+provisioning_phase_seconds = registry.register(Histogram(
+    'provisioning_phase_seconds', 'Durata delle fasi di provisioning',
+    ('phase', 'tier', 'node'), buckets=PHASE_BUCKETS))
+provisioning_job_seconds = registry.register(Histogram(
+    'provisioning_job_seconds', 'Durata complessiva di un job di provisioning',
+    ('tier', 'result'), buckets=PHASE_BUCKETS))
+clone_failures = registry.register(Counter(
+    'provisioning_clone_failures_total', 'Clone falliti', ('node', 'mode')))
+clone_timeouts = registry.register(Counter(
+    'provisioning_clone_timeouts_total', 'Clone non terminati entro il timeout', ('node', 'mode')))
+provisioning_in_flight = registry.register(Gauge(
+    'provisioning_in_flight', 'Provisioning in corso', ('tier',)))
+warm_pool_hits = registry.register(Counter(
+    'warm_pool_hits_total', 'Approvazioni servite da un CT del warm pool', ('tier',)))
+warm_pool_misses = registry.register(Counter(
+    'warm_pool_misses_total', 'Approvazioni con il warm pool vuoto (clone completo)', ('tier',)))
+fragment_cache_hits = registry.register(Counter(
+    'fragment_cache_hits_total', 'Liste delle dashboard servite dalla cache di frammenti', ('scope',)))
+fragment_cache_misses = registry.register(Counter(
+    'fragment_cache_misses_total', 'Liste delle dashboard renderizzate di nuovo', ('scope',)))
+http_request_seconds = registry.register(Histogram(
+    'http_request_seconds', 'Durata delle richieste HTTP per endpoint Flask',
+    ('endpoint', 'method', 'status')))
+
+_ENDPOINT_PARAMS = {'nodes': '{node}', 'lxc': '{vmid}', 'qemu': '{vmid}', 'tasks': '{upid}'}
+
+
+def endpoint_template(path):
+    """/nodes/px1/lxc/1042/status/start -> /nodes/{node}/lxc/{vmid}/status/start"""
+    parts = path.split('?', 1)[0].split('/')
+    for i in range(1, len(parts)):
+        param = _ENDPOINT_PARAMS.get(parts[i - 1])
+        if param and parts[i] and (param != '{vmid}' or parts[i].isdigit()):
+            parts[i] = param
+    return re.sub(r'/\d+(?=/|$)', '/{id}', '/'.join(parts))
+
+
+def observe_phase(phase, tier, node, seconds):
+    provisioning_phase_seconds.observe(seconds, phase=phase, tier=tier or '', node=node)
+
+
+logger = logging.getLogger(__name__)
+
+
+def _authorized(header):
+    return bool(METRICS_TOKEN) and hmac.compare_digest(header or '', f'Bearer {METRICS_TOKEN}')
+
+
+def init_app(app):
+    from flask import g, request, Response
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.monotonic()
+
+    @app.after_request
+    def _observe_request(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            http_request_seconds.observe(time.monotonic() - started, endpoint=request.endpoint or 'unknown',
+                                         method=request.method, status=response.status_code)
+        return response
+
+    def metrics_view():
+        if not _authorized(request.headers.get('Authorization')):
+            return Response('Non autorizzato\n', status=401)
+        return Response(registry.render(), content_type=CONTENT_TYPE)
+
+    if METRICS_TOKEN:
+        app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+
+def start_metrics_server(port, host='0.0.0.0'):
+    """Espone /metrics su una porta dedicata per i processi senza Flask (worker di provisioning).
+
+    Restituisce None senza avviare nulla se METRICS_TOKEN non è impostato.
+    """
+    if not METRICS_TOKEN:
+        logger.warning('METRICS_TOKEN non impostato: /metrics sulla porta %s non viene esposto', port)
+        return None
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if not _authorized(self.headers.get('Authorization')):
+                self.send_response(401)
+                self.end_headers()
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,64 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+# 0 calcola gli hash nel thread della richiesta (utile in sviluppo e nei test). Ogni worker gunicorn
+# ha il suo pool: il default divide i core tra i WEB_CONCURRENCY processi (gunicorn.conf.py lo imposta)
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS',
+                                      max((os.cpu_count() or 1) // int(os.getenv('WEB_CONCURRENCY', 1)), 1)))
+PASSWORD_HASH_QUEUE = int(os.getenv('PASSWORD_HASH_QUEUE', max(PASSWORD_HASH_WORKERS, 1) * 4))
+
+
+class PasswordHashBusy(Exception):
+    pass
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_QUEUE)
+_method_prefix = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # Niente fork del worker web: si porterebbe dietro thread, lock e connessioni aperte
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                _executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS,
+                                                mp_context=multiprocessing.get_context(method))
+    return _executor
+
+
+def _run(fn, *args):
+    if PASSWORD_HASH_WORKERS <= 0:
+        return fn(*args)
+    # Con la coda piena si rifiuta subito invece di tenere occupato il thread web
+    if not _slots.acquire(blocking=False):
+        raise PasswordHashBusy()
+    try:
+        return _get_executor().submit(fn, *args).result()
+    finally:
+        _slots.release()
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+
+def verify_password(pwhash, password):
+    return _run(check_password_hash, pwhash, password)
+
+
+def needs_rehash(pwhash):
+    """Può sollevare PasswordHashBusy: la prima chiamata calcola un hash nel pool."""
+    global _method_prefix
+    if _method_prefix is None:
+        # Il prefisso dell'hash contiene metodo e parametri effettivi (es. 'scrypt:32768:8:1')
+        _method_prefix = hash_password('').split('$', 1)[0]
+    return pwhash.split('$', 1)[0] != _method_prefix
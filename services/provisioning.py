@@ -0,0 +1,326 @@
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from models.connection import db
+from models.model import ProvisioningJob
+from routes.api import (start_clone, wait_clone, configure_container, start_container, container_status,
+                        get_container_ip, node_index_for, CT_TYPE_TO_NODE, PROVISIONING_MODES, PROXMOX_NODES,
+                        CT_DEFAULT_USER, CT_DEFAULT_PASSWORD)
+from services.ctid import reserve_ctid, mark_ctid_used, release_unused_ctid
+from services.events import notify_request_changed
+from services.fragment_cache import invalidate_requests
+from services.hosts import host_for
+from services.inventory import start_syncer
+from services.ipam import allocate_ip, lease_for, net0_config, release_ip
+from services.metrics import observe_phase, provisioning_in_flight, provisioning_job_seconds, start_metrics_server
+from services import topology
+from services.idle import start_idle_policy
+from services.reconciler import queue_destruction, start_reconciler
+from services.scheduler import pick_node
+from services.warm_pool import claim_warm_container, start_refiller
+
+logger = logging.getLogger(__name__)
+
+NODE_CONCURRENCY = int(os.getenv('PROVISIONING_NODE_CONCURRENCY', 2))
+
+# Limita i clone contemporanei sullo stesso nodo, così una coda di richieste
+# si distribuisce sui nodi invece di saturarne uno solo
+_node_slots = defaultdict(lambda: threading.BoundedSemaphore(NODE_CONCURRENCY))
+
+# Passi salvati su CTRequest.provision_step: un job ripreso riparte dall'ultimo completato
+STEPS = ('ctid_reserved', 'clone_started', 'cloned', 'configured', 'started', 'ip_known')
+# Un job running senza heartbeat da più di così è di un worker morto e torna in coda
+STALE_AFTER = timedelta(seconds=float(os.getenv('PROVISIONING_STALE_AFTER', 300)))
+RESUME_INTERVAL = 30
+# Attesa massima di uno slot del nodo tra un heartbeat e l'altro
+SLOT_WAIT_HEARTBEAT = 30
+
+
+class StaleClaimError(Exception):
+    """Il job è stato rimesso in coda e ripreso da un altro worker: questo thread deve fermarsi."""
+
+
+def enqueue_provisioning(req):
+    req.status = 'provisioning'
+    job = ProvisioningJob(ct_request=req, status='queued')
+    db.session.add(job)
+    return job
+
+
+def claim_next_job():
+    while True:
+        job_id = db.session.execute(
+            db.select(ProvisioningJob.id)
+            .filter_by(status='queued')
+            .order_by(ProvisioningJob.id)
+            .limit(1)
+        ).scalar_one_or_none()
+        if job_id is None:
+            return None
+
+        # L'UPDATE condizionato fa da lock: un solo worker vede rowcount == 1
+        claimed = db.session.execute(
+            db.update(ProvisioningJob)
+            .where(ProvisioningJob.id == job_id, ProvisioningJob.status == 'queued')
+            .values(status='running', started_at=datetime.utcnow(), heartbeat_at=datetime.utcnow(),
+                    attempts=ProvisioningJob.attempts + 1)
+        )
+        db.session.commit()
+        if claimed.rowcount == 1:
+            return job_id
+
+
+def _check_claim(job):
+    """Rinnova l'heartbeat se il job è ancora di questo thread, altrimenti annulla la transazione.
+
+    job.claimed_attempt è il numero di tentativo letto alla presa in carico: se nel frattempo il
+    job è stato rimesso in coda e ripreso, attempts è cambiato e l'UPDATE non trova la riga.
+    """
+    claimed = db.session.execute(
+        db.update(ProvisioningJob)
+        .where(ProvisioningJob.id == job.id, ProvisioningJob.status == 'running',
+               ProvisioningJob.attempts == job.claimed_attempt)
+        .values(heartbeat_at=datetime.utcnow())
+    )
+    if claimed.rowcount != 1:
+        db.session.rollback()
+        raise StaleClaimError(f'Job {job.id} ripreso da un altro worker')
+
+
+def _save_step(req, job, step, **fields):
+    for name, value in fields.items():
+        setattr(req, name, value)
+    req.provision_step = step
+    _check_claim(job)
+    db.session.commit()
+
+
+def _heartbeat(job):
+    _check_claim(job)
+    db.session.commit()
+
+
+def _reset_steps(req, job, clone_started=False):
+    """Il clone non è avvenuto: l'IP torna libero e il prossimo tentativo riparte da capo.
+
+    Se il task di clone era partito può aver lasciato un CT a metà con quel ctid: va in coda al
+    reconciler, che lo elimina e solo dopo libera il CTID. Altrimenti il CTID si libera subito.
+    """
+    ctid = req.ct_vmid
+    if clone_started:
+        queue_destruction(ctid, req.ct_node, reason='clone-failed')
+    _save_step(req, job, None, ct_vmid=None, ct_node=None, provision_upid=None)
+    release_ip(ctid)
+    if not clone_started:
+        release_unused_ctid(ctid)
+
+
+@contextmanager
+def _node_slot(node_index, job):
+    """Slot di clone sul nodo; durante l'attesa il job continua a battere l'heartbeat."""
+    slot = _node_slots[node_index]
+    while not slot.acquire(timeout=SLOT_WAIT_HEARTBEAT):
+        _heartbeat(job)
+    try:
+        yield
+    finally:
+        slot.release()
+
+
+def provision_request(req, job):
+    """Porta la richiesta fino al CT avviato, salvando ogni passo completato su req.provision_step."""
+    ct_type = req.machine_name
+    cpu, ram = req.machine_cpu, req.machine_ram
+
+    if req.provision_step is None:
+        warm = claim_warm_container(ct_type)
+        if warm is not None:
+            # Stesso commit dell'uscita dal pool
+            _save_step(req, job, 'cloned', ct_vmid=warm['ct_vmid'], ct_node=warm['node'])
+        else:
+            node_index = pick_node(cpu, ram, ct_type)
+            if node_index is None:
+                node_index = CT_TYPE_TO_NODE.get(ct_type)
+            ctid = reserve_ctid()
+            if ctid is None:
+                return {'success': False, 'error': 'Impossibile ottenere CTID'}
+            _save_step(req, job, 'ctid_reserved', ct_vmid=ctid, ct_node=PROXMOX_NODES[node_index])
+
+    ctid = req.ct_vmid
+    node = req.ct_node
+    node_index = node_index_for(node)
+
+    if req.provision_step in ('ctid_reserved', 'clone_started'):
+        with _node_slot(node_index, job):
+            mode = PROVISIONING_MODES.get(ct_type, 'full')
+            started = None
+            if req.provision_step == 'ctid_reserved':
+                started = time.monotonic()
+                result = start_clone(node_index, ctid, f'ct-{ct_type.lower()}-{ctid}', mode=mode, tier=ct_type)
+                if not result['success']:
+                    _reset_steps(req, job)
+                    return result
+                mode = result['mode']
+                _save_step(req, job, 'clone_started', provision_upid=result['upid'])
+            result = wait_clone(node_index, req.provision_upid, mode=mode, tier=ct_type, started=started,
+                                on_wait=lambda: _heartbeat(job))
+        if not result['success']:
+            # Dopo un timeout il task può ancora finire: il prossimo tentativo lo riattende
+            if not result.get('timeout'):
+                _reset_steps(req, job, clone_started=True)
+            return result
+        mark_ctid_used(ctid)
+        _save_step(req, job, 'cloned', provision_upid=None)
+
+    if req.provision_step == 'cloned':
+        params = {'hostname': f'ct-{ct_type.lower()}-{ctid}', 'cores': cpu, 'memory': ram * 1024}
+        lease = lease_for(ctid) or allocate_ip(ctid)
+        if lease is not None:
+            params['net0'] = net0_config(lease)
+        result = configure_container(node_index, ctid, tier=ct_type, **params)
+        if not result['success']:
+            return result
+        _save_step(req, job, 'configured', ct_ip=lease.address if lease else None)
+
+    if req.provision_step == 'configured':
+        started = time.monotonic()
+        # Se il worker è morto subito dopo lo start il CT è già acceso e lo start fallisce
+        if not start_container(node_index, ctid) and container_status(node_index, ctid) != 'running':
+            return {'success': False, 'error': 'Avvio container fallito'}
+        observe_phase('start', ct_type, node, time.monotonic() - started)
+        _save_step(req, job, 'started')
+
+    if req.provision_step == 'started':
+        ip = req.ct_ip
+        if not ip:
+            started = time.monotonic()
+            ip = get_container_ip(host_for(node_index), node, ctid)
+            observe_phase('ip_discovery', ct_type, node, time.monotonic() - started)
+        _save_step(req, job, 'ip_known', ct_ip=ip)
+
+    return {
+        'success': True,
+        'ct_vmid': ctid,
+        'node': node,
+        'ip': req.ct_ip,
+        'ct_user': CT_DEFAULT_USER,
+        'ct_password': CT_DEFAULT_PASSWORD,
+    }
+
+
+def run_job(job_id):
+    job = db.session.get(ProvisioningJob, job_id)
+    # Resta sull'istanza anche quando i commit la fanno rileggere dal DB
+    job.claimed_attempt = job.attempts
+    req = job.ct_request
+
+    ct_type = req.machine_name
+    started = time.monotonic()
+    provisioning_in_flight.inc(tier=ct_type)
+    try:
+        if req.provision_step:
+            logger.info('CTRequest %s: ripresa dal passo %s', req.id, req.provision_step)
+        result = provision_request(req, job)
+    except StaleClaimError as e:
+        logger.warning('CTRequest %s: %s, il thread si ferma', req.id, e)
+        return {'success': False, 'error': str(e)}
+    except Exception as e:
+        db.session.rollback()
+        result = {'success': False, 'error': str(e)}
+    finally:
+        provisioning_in_flight.dec(tier=ct_type)
+    provisioning_job_seconds.observe(time.monotonic() - started, tier=ct_type,
+                                     result='done' if result.get('success') else 'failed')
+
+    # L'esito si scrive solo se il job è ancora nostro, nella stessa transazione del controllo
+    try:
+        _check_claim(job)
+    except StaleClaimError as e:
+        logger.warning('CTRequest %s: %s, esito scartato', req.id, e)
+        return {'success': False, 'error': str(e)}
+
+    job.finished_at = datetime.utcnow()
+    if result.get('success'):
+        job.status = 'done'
+        req.status = 'approved'
+        req.ct_ip = result['ip']
+        req.ct_hostname = f'ct-{ct_type.lower()}-{result["ct_vmid"]}'
+        req.ct_user = result['ct_user']
+        req.ct_password = result['ct_password']
+        req.ct_vmid = result['ct_vmid']
+        req.ct_node = result['node']
+    else:
+        job.status = 'failed'
+        job.error = result.get('error', 'Errore sconosciuto')
+        req.status = 'failed'
+        logger.warning('Provisioning CTRequest %s fallito: %s', req.id, job.error)
+    db.session.commit()
+    invalidate_requests(req)
+    notify_request_changed(req)
+    return result
+
+
+def requeue_stale_jobs(stale_after=STALE_AFTER):
+    """Rimette in coda i job running di worker morti: ripartono dall'ultimo passo salvato."""
+    cutoff = datetime.utcnow() - stale_after
+    requeued = db.session.execute(
+        db.update(ProvisioningJob)
+        .where(ProvisioningJob.status == 'running',
+               db.func.coalesce(ProvisioningJob.heartbeat_at, ProvisioningJob.started_at) < cutoff)
+        .values(status='queued')
+    )
+    db.session.commit()
+    if requeued.rowcount:
+        logger.warning('Rimessi in coda %s job di provisioning interrotti', requeued.rowcount)
+    return requeued.rowcount
+
+
+def _run_job_in_context(app, job_id, slots):
+    try:
+        with app.app_context():
+            run_job(job_id)
+    except Exception:
+        logger.exception('Errore inatteso nel job %s', job_id)
+    finally:
+        slots.release()
+
+
+def run_worker(app, concurrency=4, poll_interval=2.0, warm_pool=True, inventory=True, metrics_port=None,
+               reconciler=True, idle_policy=True):
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    topology.start_refresher()
+    if warm_pool:
+        start_refiller(app)
+    if inventory:
+        start_syncer(app)
+    if reconciler:
+        start_reconciler(app)
+    if idle_policy and inventory:
+        start_idle_policy(app)
+
+    slots = threading.Semaphore(concurrency)
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='provisioning')
+    logger.info('Worker di provisioning avviato (concurrency=%s)', concurrency)
+    last_resume = 0
+    try:
+        while True:
+            slots.acquire()
+            with app.app_context():
+                if time.monotonic() - last_resume >= RESUME_INTERVAL:
+                    last_resume = time.monotonic()
+                    requeue_stale_jobs()
+                job_id = claim_next_job()
+            if job_id is None:
+                slots.release()
+                time.sleep(poll_interval)
+                continue
+            executor.submit(_run_job_in_context, app, job_id, slots)
+    finally:
+        executor.shutdown(wait=True)
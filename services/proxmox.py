@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+
+from services.metrics import proxmox_request_seconds, proxmox_request_errors, endpoint_template
+
+
+class ProxmoxClient:
+    """Client HTTP per le API Proxmox con una connessione keep-alive riusata per ogni host."""
+
+    def __init__(self, token_id, token_secret, port=8006, connect_timeout=3.05, read_timeout=15,
+                 retries=3, backoff_factor=0.5, pool_size=10, verify=False, scheme='https',
+                 probe_connect_timeout=1.5, probe_read_timeout=5):
+        self.port = port
+        self.scheme = scheme
+        self.timeout = (connect_timeout, read_timeout)
+        # Failover e controlli di salute: un host lento va scartato subito, non atteso
+        self.probe_timeout = (probe_connect_timeout, probe_read_timeout)
+        self.verify = verify
+        self.pool_size = pool_size
+        self.headers = {'Authorization': f'PVEAPIToken={token_id}={token_secret}'}
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._sessions = {}
+        self._lock = threading.Lock()
+        # Chiamate con (host, secondi, status_code, error) dopo ogni risposta, es. il selettore degli host
+        self.listeners = []
+
+    def base_url(self, host):
+        return f'{self.scheme}://{host}:{self.port}/api2/json'
+
+    def session(self, host, retries=True):
+        key = (host, retries)
+        session = self._sessions.get(key)
+        if session is not None:
+            return session
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                # requests si importa solo alla prima chiamata: il processo web non lo carica all'avvio
+                import requests
+                import urllib3
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+
+                urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+                # Solo le GET sono idempotenti: le POST (clone, start) non vanno mai ripetute
+                retry = Retry(
+                    total=self.retries,
+                    backoff_factor=self.backoff_factor,
+                    status_forcelist=(500, 502, 503, 504),
+                    allowed_methods=frozenset(['GET']),
+                    raise_on_status=False,
+                )
+                session = requests.Session()
+                session.headers.update(self.headers)
+                session.verify = self.verify
+                # Senza retry ogni tentativo fallito arriva ai listener: il selettore li conta tutti
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size,
+                                      max_retries=retry if retries else 0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._sessions[key] = session
+        return session
+
+    def request(self, method, host, path, retries=True, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        # Passato a ogni chiamata: REQUESTS_CA_BUNDLE nell'ambiente avrebbe la precedenza su session.verify
+        kwargs.setdefault('verify', self.verify)
+        labels = {'method': method, 'endpoint': endpoint_template(path), 'host': host}
+        started = time.monotonic()
+        try:
+            r = self.session(host, retries).request(method, f'{self.base_url(host)}{path}', **kwargs)
+        except Exception as e:
+            elapsed = time.monotonic() - started
+            proxmox_request_seconds.observe(elapsed, **labels)
+            proxmox_request_errors.inc(reason=type(e).__name__, **labels)
+            self._notify(host, elapsed, error=e)
+            raise
+        elapsed = time.monotonic() - started
+        proxmox_request_seconds.observe(elapsed, **labels)
+        if r.status_code >= 300:
+            proxmox_request_errors.inc(reason=str(r.status_code), **labels)
+        self._notify(host, elapsed, status_code=r.status_code)
+        return r
+
+    def _notify(self, host, seconds, status_code=None, error=None):
+        for listener in self.listeners:
+            listener(host, seconds, status_code=status_code, error=error)
+
+    def get(self, host, path, **kwargs):
+        return self.request('GET', host, path, **kwargs)
+
+    def probe(self, host, path, **kwargs):
+        """GET senza retry e con timeout brevi, per il failover tra host e i controlli di salute."""
+        kwargs.setdefault('timeout', self.probe_timeout)
+        return self.request('GET', host, path, retries=False, **kwargs)
+
+    def post(self, host, path, data=None, **kwargs):
+        return self.request('POST', host, path, data=data, **kwargs)
+
+    def put(self, host, path, data=None, **kwargs):
+        return self.request('PUT', host, path, data=data, **kwargs)
+
+    def delete(self, host, path, **kwargs):
+        return self.request('DELETE', host, path, **kwargs)
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ProxmoxClient(
+                    os.getenv('PX_TOKEN_ID'),
+                    os.getenv('PX_TOKEN_SECRET'),
+                    port=int(os.getenv('PROXMOX_PORT', 8006)),
+                    connect_timeout=float(os.getenv('PROXMOX_CONNECT_TIMEOUT', 3.05)),
+                    read_timeout=float(os.getenv('PROXMOX_READ_TIMEOUT', 15)),
+                    retries=int(os.getenv('PROXMOX_RETRIES', 3)),
+                    pool_size=int(os.getenv('PROXMOX_POOL_SIZE', 10)),
+                    probe_read_timeout=float(os.getenv('PROXMOX_PROBE_TIMEOUT', 5)),
+                    # http solo per il finto Proxmox dei benchmark
+                    scheme=os.getenv('PROXMOX_SCHEME', 'https'),
+                )
+    return _client
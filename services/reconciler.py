@@ -0,0 +1,215 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from models.connection import db
+from models.model import CTRequest, ContainerDestruction, CTIDReservation, MACHINE_TYPES, WarmContainer
+from routes.api import destroy_container, node_index_for
+from services.ctid import release_ctid
+from services.hosts import cluster_get
+from services.ipam import release_ip
+from services.metrics import registry, Counter
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_INTERVAL = float(os.getenv('RECONCILE_INTERVAL', 300))
+# Le eliminazioni messe in coda dal portale si controllano più spesso del confronto completo
+DESTRUCTION_POLL_INTERVAL = float(os.getenv('DESTRUCTION_POLL_INTERVAL', 10))
+RECONCILE_CONCURRENCY = int(os.getenv('RECONCILE_CONCURRENCY', 6))
+# Spegnere ed eliminare pesa sullo storage del nodo quanto un clone: pochi alla volta per nodo
+RECONCILE_NODE_CONCURRENCY = int(os.getenv('RECONCILE_NODE_CONCURRENCY', 2))
+# Una distruzione rimasta running così a lungo è di un worker morto e torna in coda
+RECONCILE_STALE_AFTER = timedelta(seconds=float(os.getenv('RECONCILE_STALE_AFTER', 600)))
+
+# Solo i container creati dal portale: hostname ct-<tipo>-<ctid> (o warm-<tipo>-<ctid> finché sono nel pool)
+HOSTNAME_RE = re.compile(r'^(?:ct|warm)-(%s)-(\d+)$' % '|'.join(m['name'].lower() for m in MACHINE_TYPES))
+
+destroyed_total = registry.register(Counter(
+    'reconciler_destroyed_total', 'Container eliminati dal reconciler', ('reason',)))
+destroy_failures = registry.register(Counter(
+    'reconciler_destroy_failures_total', 'Eliminazioni di container fallite', ('reason',)))
+
+_node_slots = defaultdict(lambda: threading.BoundedSemaphore(RECONCILE_NODE_CONCURRENCY))
+
+
+def queue_destruction(ct_vmid, node=None, reason='deleted'):
+    """Mette in coda l'eliminazione del CT; il commit resta al chiamante."""
+    if db.session.execute(db.select(ContainerDestruction.id).filter_by(ct_vmid=ct_vmid)).first() is None:
+        db.session.add(ContainerDestruction(ct_vmid=ct_vmid, node=node, reason=reason, status='queued'))
+
+
+def _known_vmids(reservations=True):
+    """Id che il portale sta usando: richieste (anche fallite o in provisioning), pool e CTID prenotati."""
+    known = set(db.session.execute(db.select(CTRequest.ct_vmid).filter(CTRequest.ct_vmid.isnot(None))).scalars())
+    known.update(db.session.execute(db.select(WarmContainer.ct_vmid)).scalars())
+    if reservations:
+        known.update(db.session.execute(db.select(CTIDReservation.vmid).filter_by(status='reserved')).scalars())
+    return known
+
+
+def find_orphans():
+    """Container del portale che esistono nel cluster ma che nessuna riga del DB conosce più.
+
+    Il cluster si legge prima del DB: un CT appena clonato ha già il suo ctid salvato e non
+    può sembrare orfano.
+    """
+    r = cluster_get('/cluster/resources', params={'type': 'vm'})
+    if r.status_code != 200:
+        raise RuntimeError(f'/cluster/resources ha risposto {r.status_code}')
+    candidates = {}
+    for res in r.json().get('data', []):
+        match = HOSTNAME_RE.match(res.get('name') or '')
+        # Il ctid nel nome deve coincidere con il vmid: un CT rinominato a mano non si tocca
+        if res.get('type') == 'lxc' and not res.get('template') and match and int(match.group(2)) == res['vmid']:
+            candidates[res['vmid']] = res
+
+    known = _known_vmids()
+    known.update(db.session.execute(db.select(ContainerDestruction.ct_vmid)).scalars())
+    return [candidates[vmid] for vmid in sorted(candidates) if vmid not in known]
+
+
+def _destroy(node, ct_vmid):
+    node_index = node_index_for(node)
+    if node_index is None:
+        return {'success': False, 'error': f'Nodo {node} sconosciuto'}
+    with _node_slots[node]:
+        return destroy_container(node_index, ct_vmid)
+
+
+def _claim(destruction):
+    claimed = db.session.execute(
+        db.update(ContainerDestruction)
+        .where(ContainerDestruction.id == destruction.id, ContainerDestruction.status == 'queued')
+        .values(status='running', started_at=datetime.utcnow(), attempts=ContainerDestruction.attempts + 1)
+    )
+    db.session.commit()
+    return claimed.rowcount == 1
+
+
+def process_destructions():
+    """Elimina i CT in coda, in parallelo con al massimo RECONCILE_NODE_CONCURRENCY per nodo."""
+    db.session.execute(
+        db.update(ContainerDestruction)
+        .where(ContainerDestruction.status == 'running',
+               ContainerDestruction.started_at < datetime.utcnow() - RECONCILE_STALE_AFTER)
+        .values(status='queued')
+    )
+    db.session.commit()
+
+    queued = db.session.execute(
+        db.select(ContainerDestruction).filter_by(status='queued').order_by(ContainerDestruction.id)
+    ).scalars().all()
+    report = {'destroyed': [], 'failed': []}
+    if not queued:
+        return report
+    # La prenotazione di una richiesta cancellata a metà provisioning è proprio da liberare
+    known = _known_vmids(reservations=False)
+    cluster_nodes = None
+    work = []
+    for destruction in queued:
+        if destruction.ct_vmid in known:
+            # Il ctid è di nuovo in uso (es. un orfano ripreso da una richiesta): non va eliminato
+            db.session.delete(destruction)
+            db.session.commit()
+            continue
+        node = destruction.node
+        if node is None:
+            if cluster_nodes is None:
+                cluster_nodes = _cluster_nodes()
+                if cluster_nodes is None:
+                    break
+            node = cluster_nodes.get(destruction.ct_vmid)
+            if node is None:
+                # Non esiste più nel cluster: restano solo IP e CTID da liberare
+                _finish(destruction, {'success': True, 'gone': True})
+                continue
+        if _claim(destruction):
+            work.append((destruction, node))
+
+    if not work:
+        return report
+    with ThreadPoolExecutor(max_workers=RECONCILE_CONCURRENCY) as executor:
+        futures = [(destruction, executor.submit(_destroy, node, destruction.ct_vmid)) for destruction, node in work]
+        for destruction, future in futures:
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'success': False, 'error': str(e)}
+            _finish(destruction, result)
+            report['destroyed' if result['success'] else 'failed'].append(destruction.ct_vmid)
+    return report
+
+
+def _cluster_nodes():
+    r = cluster_get('/cluster/resources', params={'type': 'vm'})
+    if r.status_code != 200:
+        return None
+    return {res['vmid']: res['node'] for res in r.json().get('data', []) if 'vmid' in res}
+
+
+def _finish(destruction, result):
+    if result['success']:
+        logger.info('CT %s eliminato (%s)', destruction.ct_vmid, destruction.reason)
+        if not result.get('gone'):
+            destroyed_total.inc(reason=destruction.reason)
+        release_ip(destruction.ct_vmid)
+        release_ctid(destruction.ct_vmid)
+        db.session.delete(destruction)
+    else:
+        logger.warning('Eliminazione del CT %s fallita: %s', destruction.ct_vmid, result.get('error'))
+        destroy_failures.inc(reason=destruction.reason)
+        destruction.status = 'queued'
+        destruction.error = result.get('error')
+    db.session.commit()
+
+
+def reconcile(dry_run=False):
+    """Confronta cluster e DB, mette in coda gli orfani ed elimina i CT in coda.
+
+    Con dry_run restituisce solo cosa verrebbe eliminato, senza toccare né il DB né il cluster.
+    """
+    orphans = find_orphans()
+    if dry_run:
+        queued = db.session.execute(
+            db.select(ContainerDestruction).order_by(ContainerDestruction.id)
+        ).scalars().all()
+        return {
+            'orphans': [{'ct_vmid': res['vmid'], 'node': res['node'], 'name': res['name'],
+                         'status': res.get('status')} for res in orphans],
+            'queued': [{'ct_vmid': d.ct_vmid, 'node': d.node, 'reason': d.reason, 'status': d.status,
+                        'attempts': d.attempts, 'error': d.error} for d in queued],
+        }
+
+    for res in orphans:
+        logger.warning('CT orfano %s (%s) su %s: eliminazione in coda', res['vmid'], res['name'], res['node'])
+        queue_destruction(res['vmid'], res['node'], reason='orphan')
+    db.session.commit()
+    report = process_destructions()
+    report['orphans'] = [res['vmid'] for res in orphans]
+    return report
+
+
+def run_reconciler(app, interval=RECONCILE_INTERVAL, poll_interval=DESTRUCTION_POLL_INTERVAL):
+    last_reconcile = None
+    while True:
+        try:
+            with app.app_context():
+                if last_reconcile is None or time.monotonic() - last_reconcile >= interval:
+                    last_reconcile = time.monotonic()
+                    reconcile()
+                else:
+                    process_destructions()
+        except Exception:
+            logger.exception('Errore nel reconciler dei container')
+        time.sleep(poll_interval)
+
+
+def start_reconciler(app, interval=RECONCILE_INTERVAL):
+    thread = threading.Thread(target=run_reconciler, args=(app, interval), name='reconciler', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,105 @@
+import logging
+import os
+import threading
+import time
+
+from routes.api import PROXMOX_HOSTS, PROXMOX_NODES
+from services.hosts import get_host_selector, host_for
+from services.inventory import get_nodes
+from services.proxmox import get_client
+from services.topology import ensure_topology, template_for
+
+logger = logging.getLogger(__name__)
+
+NODE_STATUS_TTL = float(os.getenv('NODE_STATUS_TTL', 10))
+GIB = 1024 ** 3
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def _fetch_node_status(node_index):
+    """CPU e RAM libere del nodo. Il disco non conta: disk/rootfs del nodo sono il filesystem di
+    sistema, non lo storage su cui finiscono i clone (PROXMOX_STORAGE o quello del template)."""
+    host = host_for(node_index)
+    node = PROXMOX_NODES[node_index]
+
+    # L'inventario ha già le letture di tutti i nodi: la chiamata al nodo serve solo senza inventario
+    inventory_node = get_nodes().get(node)
+    if inventory_node is not None:
+        return {
+            'free_cpu': (inventory_node.maxcpu or 0) * (1 - (inventory_node.cpu or 0)),
+            'free_mem': (inventory_node.maxmem or 0) - (inventory_node.mem or 0),
+        }
+
+    try:
+        r = get_client().get(host, f'/nodes/{node}/status')
+        if r.status_code != 200:
+            return None
+        data = r.json().get('data', {})
+    except Exception as e:
+        logger.warning('Stato del nodo %s non disponibile: %s', node, e)
+        return None
+
+    cpus = data.get('cpuinfo', {}).get('cpus', 0)
+    memory = data.get('memory', {})
+    return {
+        'free_cpu': cpus * (1 - data.get('cpu', 0)),
+        'free_mem': memory.get('total', 0) - memory.get('used', 0),
+    }
+
+
+def get_node_status(node_index):
+    now = time.monotonic()
+    with _lock:
+        cached = _cache.get(node_index)
+        if cached and now - cached[0] < NODE_STATUS_TTL:
+            return cached[1]
+
+    status = _fetch_node_status(node_index)
+    with _lock:
+        _cache[node_index] = (now, status)
+    return status
+
+
+def _score(status, cpu, ram):
+    if status['free_mem'] < ram * GIB:
+        return None
+    return min(status['free_cpu'] / cpu, status['free_mem'] / (ram * GIB))
+
+
+def pick_node(cpu, ram, tier=None):
+    """Sceglie il nodo con più margine per cpu core e ram GiB, None se nessun nodo risponde.
+
+    Con tier contano anche i nodi che hanno solo il template di quel tipo.
+    """
+    ensure_topology()
+    selector = get_host_selector()
+    # Solo i nodi con un template; quelli con il circuito aperto (host che non risponde)
+    # si usano solo se non ne resta nessun altro
+    nodes = [i for i in range(len(PROXMOX_NODES)) if template_for(i, tier) is not None]
+    candidates = [i for i in nodes if selector.is_available(PROXMOX_HOSTS[i])]
+    best_index, best_score = None, None
+    fallback_index, fallback_mem = None, None
+    for node_index in candidates or nodes:
+        status = get_node_status(node_index)
+        if status is None:
+            continue
+        score = _score(status, cpu, ram)
+        if score is not None and (best_score is None or score > best_score):
+            best_index, best_score = node_index, score
+        if fallback_mem is None or status['free_mem'] > fallback_mem:
+            fallback_index, fallback_mem = node_index, status['free_mem']
+
+    node_index = best_index if best_index is not None else fallback_index
+    if node_index is None:
+        return None
+
+    # Sconta subito le risorse dalla lettura in cache, così una raffica di
+    # approvazioni dentro lo stesso TTL non finisce tutta sullo stesso nodo
+    with _lock:
+        cached = _cache.get(node_index)
+        if cached and cached[1] is not None:
+            cached[1]['free_cpu'] -= cpu
+            cached[1]['free_mem'] -= ram * GIB
+    return node_index
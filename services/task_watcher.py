@@ -0,0 +1,132 @@
+import logging
+import threading
+from concurrent.futures import Future
+
+from services.hosts import get_host_selector
+from services.proxmox import get_client
+
+logger = logging.getLogger(__name__)
+
+
+class _Watch:
+    def __init__(self, host, node, upid):
+        self.host = host
+        self.node = node
+        self.upid = upid
+        self.future = Future()
+        self.misses = 0
+
+
+class TaskWatcher:
+    """Segue tutti i task Proxmox in corso con una sola GET /cluster/tasks per tick.
+
+    Il carico sulle API dipende dal numero di tick, non dal numero di clone in volo:
+    l'intervallo riparte da min_interval quando arriva un nuovo task o se ne chiude uno,
+    altrimenti cresce fino a max_interval. Un task che non compare nella lista per
+    missing_ticks tick consecutivi viene interrogato singolarmente.
+    """
+
+    def __init__(self, client, selector, min_interval=1.0, max_interval=10.0, missing_ticks=5):
+        self.client = client
+        self.selector = selector
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.missing_ticks = missing_ticks
+        self._watches = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def watch(self, host, node, upid):
+        watch = _Watch(host, node, upid)
+        with self._lock:
+            self._watches[upid] = watch
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='task-watcher', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return watch.future
+
+    def forget(self, upid):
+        with self._lock:
+            self._watches.pop(upid, None)
+
+    def _run(self):
+        interval = self.min_interval
+        while True:
+            self._wakeup.wait(interval)
+            woken = self._wakeup.is_set()
+            self._wakeup.clear()
+            with self._lock:
+                if not self._watches:
+                    interval = self.min_interval
+                    continue
+            try:
+                resolved = self._tick()
+            except Exception:
+                logger.exception('Errore nel controllo dei task Proxmox')
+                resolved = 0
+            if resolved or woken:
+                interval = self.min_interval
+            else:
+                interval = min(interval * 1.5, self.max_interval)
+
+    def _tick(self):
+        with self._lock:
+            watches = list(self._watches.values())
+
+        tasks = {}
+        try:
+            # Qualsiasi host del cluster vede i task di tutti i nodi: si usa il più veloce disponibile
+            r = self.selector.cluster_get('/cluster/tasks')
+            if r.status_code == 200:
+                tasks = {t.get('upid'): t for t in r.json().get('data', [])}
+        except Exception as e:
+            logger.warning('GET /cluster/tasks fallita: %s', e)
+
+        resolved = 0
+        for watch in watches:
+            task = tasks.get(watch.upid)
+            if task is None:
+                watch.misses += 1
+                if watch.misses < self.missing_ticks:
+                    continue
+                watch.misses = 0
+                task = self._task_status(watch)
+                if task is None:
+                    continue
+            elif task.get('endtime'):
+                task = {'status': 'stopped', 'exitstatus': task.get('status')}
+            else:
+                watch.misses = 0
+                continue
+
+            if task.get('status') == 'stopped':
+                self.forget(watch.upid)
+                if not watch.future.done():
+                    watch.future.set_result(task)
+                resolved += 1
+        return resolved
+
+    def _task_status(self, watch):
+        try:
+            host = watch.host if self.selector.is_available(watch.host) else self.selector.cluster_host()
+            r = self.client.get(host, f'/nodes/{watch.node}/tasks/{watch.upid}/status')
+            if r.status_code != 200:
+                return None
+            return r.json().get('data', {})
+        except Exception:
+            return None
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def get_task_watcher():
+    global _watcher
+    if _watcher is None:
+        with _watcher_lock:
+            if _watcher is None:
+                _watcher = TaskWatcher(get_client(), get_host_selector())
+    return _watcher
@@ -0,0 +1,105 @@
+import logging
+import os
+import threading
+import time
+
+from routes.api import PROXMOX_HOSTS, PROXMOX_NODES, PROXMOX_TEMPLATE_IDS
+from services.hosts import get_host_selector
+
+logger = logging.getLogger(__name__)
+
+TOPOLOGY_REFRESH_INTERVAL = float(os.getenv('TOPOLOGY_REFRESH_INTERVAL', 300))
+# I template dei CT si riconoscono dal tag (o dal nome): "ct-template" vale per tutti i tipi,
+# "ct-template-gold" solo per i Gold e ha la precedenza
+TEMPLATE_TAG = os.getenv('PROXMOX_TEMPLATE_TAG', 'ct-template')
+
+# (nodo, tipo) -> vmid del template specifico del tipo
+tier_templates = {}
+
+_refreshed_at = None
+_lock = threading.Lock()
+
+
+def _template_labels(res):
+    tags = {t.strip() for t in (res.get('tags') or '').replace(',', ';').split(';') if t.strip()}
+    return tags | {res.get('name')}
+
+
+def refresh_topology():
+    """Rilegge nodi, indirizzi e template dal cluster e aggiorna sul posto le liste di routes.api.
+
+    I nodi già noti mantengono la loro posizione e quelli nuovi si aggiungono in fondo, così gli
+    indici in uso nel processo restano validi. Se il cluster non risponde resta la configurazione attuale.
+    """
+    global _refreshed_at
+    selector = get_host_selector()
+    try:
+        r = selector.cluster_get('/cluster/status')
+        resources = selector.cluster_get('/cluster/resources', params={'type': 'vm'})
+        if r.status_code != 200 or resources.status_code != 200:
+            logger.warning('Topologia del cluster non disponibile: HTTP %s/%s', r.status_code, resources.status_code)
+            return False
+        nodes = {n['name']: n.get('ip') for n in r.json().get('data', []) if n.get('type') == 'node'}
+        templates = [res for res in resources.json().get('data', [])
+                     if res.get('template') and res.get('type') == 'lxc']
+    except Exception as e:
+        logger.warning('Topologia del cluster non disponibile: %s', e)
+        return False
+
+    generic = {}
+    specific = {}
+    for res in sorted(templates, key=lambda res: res['vmid']):
+        labels = _template_labels(res)
+        if TEMPLATE_TAG in labels:
+            generic.setdefault(res['node'], res['vmid'])
+        for label in labels:
+            if label and label.startswith(f'{TEMPLATE_TAG}-'):
+                specific.setdefault((res['node'], label[len(TEMPLATE_TAG) + 1:]), res['vmid'])
+
+    with _lock:
+        for node in sorted(nodes):
+            if node not in PROXMOX_NODES:
+                logger.info('Nuovo nodo Proxmox %s (%s)', node, nodes[node])
+                PROXMOX_NODES.append(node)
+                PROXMOX_HOSTS.append(nodes[node] or node)
+                PROXMOX_TEMPLATE_IDS.append(None)
+            index = PROXMOX_NODES.index(node)
+            if nodes[node]:
+                PROXMOX_HOSTS[index] = nodes[node]
+            if node in generic:
+                PROXMOX_TEMPLATE_IDS[index] = generic[node]
+        tier_templates.clear()
+        tier_templates.update(specific)
+        _refreshed_at = time.monotonic()
+
+    selector.update_hosts(PROXMOX_HOSTS)
+    return True
+
+
+def ensure_topology(max_age=TOPOLOGY_REFRESH_INTERVAL):
+    if _refreshed_at is None or time.monotonic() - _refreshed_at >= max_age:
+        refresh_topology()
+
+
+def template_for(node_index, tier=None):
+    """Template da clonare sul nodo per il tipo indicato, None se il nodo non ne ha."""
+    if tier:
+        vmid = tier_templates.get((PROXMOX_NODES[node_index], tier.lower()))
+        if vmid is not None:
+            return vmid
+    return PROXMOX_TEMPLATE_IDS[node_index]
+
+
+def run_refresher(interval=TOPOLOGY_REFRESH_INTERVAL):
+    while True:
+        try:
+            refresh_topology()
+        except Exception:
+            logger.exception('Errore nel refresh della topologia')
+        time.sleep(interval)
+
+
+def start_refresher(interval=TOPOLOGY_REFRESH_INTERVAL):
+    thread = threading.Thread(target=run_refresher, args=(interval,), name='topology', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,153 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from models.connection import db
+from models.model import WarmContainer, MACHINE_TYPES, parse_tier_values
+from routes.api import (clone_template, container_status, node_index_for, CT_TYPE_TO_NODE,
+                        PROVISIONING_MODES, PROXMOX_NODES)
+from services.ctid import reserve_ctid, mark_ctid_used, release_unused_ctid
+from services.metrics import warm_pool_hits, warm_pool_misses
+from services.reconciler import queue_destruction
+from services.scheduler import pick_node
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZES = parse_tier_values(os.getenv('WARM_POOL_SIZES', 'Bronze=3,Silver=2,Gold=1'), int)
+REFILL_INTERVAL = float(os.getenv('WARM_POOL_REFILL_INTERVAL', 30))
+# Un clone ancora 'cloning' dopo questo tempo è di un refiller morto (wait_clone si arrende dopo 300 s)
+CLONE_STALE_AFTER = timedelta(seconds=float(os.getenv('WARM_POOL_CLONE_STALE_AFTER', 900)))
+
+stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(key):
+    with _stats_lock:
+        stats[key] += 1
+
+
+def claim_warm_container(ct_type):
+    """Prende un container già clonato del tipo richiesto, None se il pool è vuoto.
+
+    Il container esce dal pool: configurazione e avvio sono passi del provisioning della richiesta.
+    Il commit resta al chiamante, insieme al CT salvato sulla richiesta: se il worker muore tra i due
+    il CT non resta fuori sia dal pool sia dalla richiesta.
+    """
+    while True:
+        warm = db.session.execute(
+            db.select(WarmContainer)
+            .filter_by(machine_name=ct_type, status='ready')
+            .order_by(WarmContainer.id)
+            .limit(1)
+        ).scalar_one_or_none()
+        if warm is None:
+            _count('misses')
+            warm_pool_misses.inc(tier=ct_type)
+            logger.info('Warm pool %s vuoto (hits=%s misses=%s)', ct_type, stats['hits'], stats['misses'])
+            return None
+
+        claimed = db.session.execute(
+            db.delete(WarmContainer)
+            .where(WarmContainer.id == warm.id, WarmContainer.status == 'ready')
+        )
+        if claimed.rowcount == 1:
+            break
+
+    _count('hits')
+    warm_pool_hits.inc(tier=ct_type)
+    logger.info('Warm pool %s: assegnato CT %s (hits=%s misses=%s)',
+                ct_type, warm.ct_vmid, stats['hits'], stats['misses'])
+    return {'ct_vmid': warm.ct_vmid, 'node': warm.node}
+
+
+def reclaim_stale_clones(stale_after=CLONE_STALE_AFTER):
+    """Sistema le righe 'cloning' lasciate da un refiller morto, che altrimenti occupano il pool per sempre.
+
+    Il task di clone su Proxmox prosegue anche senza il refiller: a questo punto è finito. Se il CT
+    esiste ed è spento è pronto, altrimenti (assente o in uno stato inatteso) la riga si elimina e il
+    CT va in coda al reconciler, che libera anche il CTID.
+    """
+    stale = db.session.execute(
+        db.select(WarmContainer)
+        .filter(WarmContainer.status == 'cloning',
+                WarmContainer.created_at < datetime.utcnow() - stale_after)
+    ).scalars().all()
+    for warm in stale:
+        node_index = node_index_for(warm.node)
+        status = container_status(node_index, warm.ct_vmid) if node_index is not None else None
+        if status == 'stopped':
+            logger.info('Warm pool %s: clone %s rimasto in cloning ma completo, torna pronto',
+                        warm.machine_name, warm.ct_vmid)
+            warm.status = 'ready'
+            db.session.commit()
+            mark_ctid_used(warm.ct_vmid)
+        else:
+            logger.warning('Warm pool %s: clone %s rimasto in cloning (stato %s), eliminazione in coda',
+                           warm.machine_name, warm.ct_vmid, status)
+            queue_destruction(warm.ct_vmid, warm.node, reason='warm-stale')
+            db.session.delete(warm)
+            db.session.commit()
+
+
+def refill_pool():
+    reclaim_stale_clones()
+    for ct_type, size in POOL_SIZES.items():
+        machine = next((m for m in MACHINE_TYPES if m['name'] == ct_type), None)
+        if machine is None:
+            continue
+
+        available = db.session.execute(
+            db.select(db.func.count(WarmContainer.id))
+            .filter(WarmContainer.machine_name == ct_type,
+                    WarmContainer.status.in_(('cloning', 'ready')))
+        ).scalar()
+
+        for _ in range(size - available):
+            node_index = pick_node(machine['cpu'], machine['ram'], ct_type)
+            if node_index is None:
+                node_index = CT_TYPE_TO_NODE.get(ct_type)
+
+            ctid = reserve_ctid()
+            if ctid is None:
+                logger.warning('Refill warm pool %s: impossibile ottenere CTID', ct_type)
+                return
+
+            warm = WarmContainer(ct_vmid=ctid, node=PROXMOX_NODES[node_index], machine_name=ct_type, status='cloning')
+            db.session.add(warm)
+            db.session.commit()
+
+            result = clone_template(node_index, ctid, f'warm-{ct_type.lower()}-{ctid}',
+                                    mode=PROVISIONING_MODES.get(ct_type, 'full'), tier=ct_type)
+            if result['success']:
+                warm.status = 'ready'
+                db.session.commit()
+                mark_ctid_used(ctid)
+            else:
+                logger.warning('Refill warm pool %s fallito: %s', ct_type, result.get('error'))
+                if result.get('clone_started'):
+                    # Il CT lasciato dal clone (anche scaduto, che può ancora finire) lo elimina il
+                    # reconciler, che poi libera il CTID
+                    queue_destruction(ctid, warm.node, reason='clone-failed')
+                db.session.delete(warm)
+                db.session.commit()
+                if not result.get('clone_started'):
+                    release_unused_ctid(ctid)
+
+
+def run_refiller(app, interval=REFILL_INTERVAL):
+    while True:
+        try:
+            with app.app_context():
+                refill_pool()
+        except Exception:
+            logger.exception('Errore nel refill del warm pool')
+        time.sleep(interval)
+
+
+def start_refiller(app, interval=REFILL_INTERVAL):
+    thread = threading.Thread(target=run_refiller, args=(app, interval), name='warm-pool', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,60 @@
+// Aggiorna sul posto le righe delle richieste con gli eventi SSE del server,
+// o con il polling di /events/poll se il server non ha stream liberi
+(function () {
+    var list = document.getElementById('request-list');
+    if (!list) {
+        return;
+    }
+    var prepend = list.dataset.prepend === '1';
+    var versions = {};
+
+    function apply(data) {
+        var row = list.querySelector('[data-req-id="' + data.id + '"]');
+        if (data.deleted) {
+            if (row) {
+                row.remove();
+            }
+            return;
+        }
+        // Il polling rimanda le righe dell'ultimo secondo: quelle già viste si saltano
+        if (versions[data.id] === data.version) {
+            return;
+        }
+        versions[data.id] = data.version;
+        var tpl = document.createElement('template');
+        tpl.innerHTML = data.html.trim();
+        if (row) {
+            row.replaceWith(tpl.content.firstElementChild);
+        } else if (prepend) {
+            list.prepend(tpl.content.firstElementChild);
+        }
+    }
+
+    function poll(since) {
+        var url = list.dataset.pollUrl + (since ? '?since=' + encodeURIComponent(since) : '');
+        fetch(url, {credentials: 'same-origin'})
+            .then(function (r) { return r.json(); })
+            .then(function (body) {
+                body.events.forEach(apply);
+                setTimeout(function () { poll(body.since); }, body.interval * 1000);
+            })
+            .catch(function () {
+                setTimeout(function () { poll(since); }, 30000);
+            });
+    }
+
+    if (!window.EventSource) {
+        poll(null);
+        return;
+    }
+    var source = new EventSource(list.dataset.eventsUrl);
+    source.onmessage = function (e) {
+        apply(JSON.parse(e.data));
+    };
+    source.onerror = function () {
+        // Chiuso senza riconnessione (204 quando gli stream sono esauriti): si passa al polling
+        if (source.readyState === EventSource.CLOSED) {
+            poll(null);
+        }
+    };
+})();